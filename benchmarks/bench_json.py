@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+The serialization time of the JSON engines over some API payloads. Every
+installed engine of puck.json_engine.ENGINE_NAMES is measured, and the
+streaming encoding(iterencode, used by jsonify_stream) of the large list
+is measured with the default engine.
+
+    python benchmarks/bench_json.py
+    python benchmarks/bench_json.py --number 2000
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from puck.json_engine import ENGINE_NAMES, get_json_engine, default_engine
+
+
+def make_record(i):
+    return {
+        'id': i,
+        'name': u'user %d é中' % i,
+        'email': 'user%d@example.com' % i,
+        'active': i % 2 == 0,
+        'score': i * 1.5,
+        'tags': ['tag%d' % (i % 7), 'tag%d' % (i % 11)],
+        'profile': {'age': 20 + i % 50, 'city': 'city %d' % (i % 100), 'bio': None},
+    }
+
+
+PAYLOADS = [
+    # the body of a 404 and the other small api responses.
+    ('error', {'code': 404, 'message': 'Not Found', 'data': None}),
+    ('record', make_record(1)),
+    ('list of 100', {'code': 200, 'message': 'OK',
+                     'data': [make_record(i) for i in range(100)]}),
+    ('list of 10k', [make_record(i) for i in range(10000)]),
+]
+
+
+def measure(func, number):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for _ in xrange(number):
+            func()
+        seconds = (time.time() - start) / number
+        best = seconds if best is None else min(best, seconds)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=1000,
+                        help='the runs of the small payloads, the large ones '
+                             'run fewer times')
+    args = parser.parse_args()
+
+    engines = []
+    for name in ENGINE_NAMES:
+        try:
+            engines.append(get_json_engine(name))
+        except ImportError:
+            print '%s is not installed' % name
+
+    print '%-12s %s' % ('payload', ' '.join('%14s' % e.name for e in engines))
+    for label, payload in PAYLOADS:
+        number = max(args.number // (1 + len(repr(payload)) // 10000), 3)
+        times = []
+        for engine in engines:
+            times.append(measure(lambda: engine.dumps(payload), number))
+        print '%-12s %s' % (label, ' '.join('%12.1fus' % t for t in times))
+
+    records = PAYLOADS[-1][1]
+    us = measure(lambda: sum(map(len, default_engine.iterencode(records))), 3)
+    print 'iterencode of 10k records by %s: %.1fms' % (default_engine.name, us / 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+The cost of the proxy access(like request.path) under the concurrent threads.
+Every thread pushes its own object into the request stack, then reads it
+through a Proxy again and again. The lock-free LocalStack of puck.local is
+compared with the same stack guarded by a global lock, which is how Local
+worked before.
+
+    python benchmarks/bench_local.py
+    python benchmarks/bench_local.py --threads 8 32 128 --accesses 20000
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from threading import Lock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from puck.local import Local, LocalStack
+from puck.globals import Proxy
+
+
+class LockedLocal(Local):
+    """Local with a global lock on every access, like the old one."""
+    __slots__ = ()
+
+    lock = Lock()
+
+    def __getattr__(self, item):
+        with self.lock:
+            return Local.__getattr__(self, item)
+
+    def __setattr__(self, key, value):
+        with self.lock:
+            Local.__setattr__(self, key, value)
+
+
+class LockedLocalStack(LocalStack):
+
+    def __init__(self):
+        self._local = LockedLocal()
+        self._lock = Lock()
+
+    def push(self, obj):
+        with self._lock:
+            return LocalStack.push(self, obj)
+
+    def pop(self):
+        with self._lock:
+            return LocalStack.pop(self)
+
+
+class _Context(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+def run(stack_class, threads, accesses):
+    """Return (microseconds per access, the number of the wrong values)."""
+    stack = stack_class()
+    proxy = Proxy(lambda: stack.top)
+    errors = []
+    start_event = threading.Event()
+
+    def work(i):
+        stack.push(_Context(i))
+        start_event.wait()
+        wrong = 0
+        for _ in xrange(accesses):
+            if proxy.value != i:
+                wrong += 1
+        stack.pop()
+        errors.append(wrong)
+
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    start = time.time()
+    start_event.set()
+    for worker in workers:
+        worker.join()
+    seconds = time.time() - start
+    return seconds / (threads * accesses) * 1e6, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--accesses', type=int, default=20000,
+                        help='the proxy accesses of every thread')
+    args = parser.parse_args()
+
+    print '%8s %14s %14s %8s' % ('threads', 'lock-free(us)', 'locked(us)', 'speedup')
+    failed = False
+    for threads in args.threads:
+        free, free_errors = run(LocalStack, threads, args.accesses)
+        locked, locked_errors = run(LockedLocalStack, threads, args.accesses)
+        print '%8d %14.3f %14.3f %7.2fx' % (threads, free, locked, locked / free)
+        if free_errors or locked_errors:
+            print '  the threads saw the values of each other: %d, %d' % (
+                free_errors, locked_errors)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+The speed and the memory of the multipart parser, for a large single-file
+upload(1 GB by default) and a form with 10k small fields. The body of the
+upload is generated while it is read, so only the parser holds the data,
+and the peak RSS shows that the memory is bounded.
+
+    python benchmarks/bench_multipart.py
+    python benchmarks/bench_multipart.py --size 100 --sink file --fields 10000
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from puck.form import iter_multipart, parse_multipart
+
+BOUNDARY = '----PuckBenchmarkBoundary7MA4YWxkTrZu0gW'
+
+MB = 1024 * 1024
+
+
+class GeneratedBody(object):
+    """A multipart body with one file of the given size, generated while it is
+    read. The data of the file is binary and has few line breaks."""
+
+    def __init__(self, size, block_size=MB):
+        self.head = (
+            '--%s\r\nContent-Disposition: form-data; name="file"; '
+            'filename="big.bin"\r\nContent-Type: application/octet-stream\r\n\r\n'
+            % BOUNDARY)
+        self.tail = '\r\n--%s--\r\n' % BOUNDARY
+        self.block = (os.urandom(1024).replace('\n', '\x00') * (block_size // 1024))
+        self.size = size
+        self.length = len(self.head) + size + len(self.tail)
+        self.pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.length - self.pos
+        chunks = []
+        while size > 0 and self.pos < self.length:
+            pos = self.pos
+            head_end = len(self.head)
+            file_end = head_end + self.size
+            if pos < head_end:
+                data = self.head[pos:pos + size]
+            elif pos < file_end:
+                offset = (pos - head_end) % len(self.block)
+                data = self.block[offset:offset + min(size, file_end - pos)]
+            else:
+                data = self.tail[pos - file_end:pos - file_end + size]
+            chunks.append(data)
+            self.pos += len(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+    def readline(self, size=-1):
+        raise NotImplementedError('the parser never reads lines')
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def bench_file(size, sink, upload_dir):
+    body = GeneratedBody(size)
+    start = time.time()
+    if sink == 'discard':
+        received = 0
+        for part in iter_multipart(body, body.length, BOUNDARY):
+            for chunk in part:
+                received += len(chunk)
+    else:
+        _, files = parse_multipart(body, body.length, BOUNDARY, upload_dir=upload_dir)
+        uploaded = files['file'].stream
+        uploaded.seek(0, 2)
+        received = uploaded.tell()
+        uploaded.close()
+    seconds = time.time() - start
+    assert received == size, 'received %d bytes, expected %d' % (received, size)
+    return seconds
+
+
+def bench_fields(fields):
+    body = ''.join(
+        '--%s\r\nContent-Disposition: form-data; name="field%d"\r\n\r\nvalue%d\r\n'
+        % (BOUNDARY, i, i) for i in range(fields)) + '--%s--\r\n' % BOUNDARY
+    start = time.time()
+    form, _ = parse_multipart(StringIO(body), len(body), BOUNDARY)
+    seconds = time.time() - start
+    assert len(form) == fields and form['field%d' % (fields - 1)] == 'value%d' % (fields - 1)
+    # read every field by name, the index of the form keeps it linear.
+    start_read = time.time()
+    for i in range(fields):
+        form['field%d' % i]
+    return seconds, time.time() - start_read
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=1024,
+                        help='the size of the uploaded file in MB, default 1024')
+    parser.add_argument('--sink', choices=('discard', 'file'), default='discard',
+                        help='drop the data of the file, or write it into a '
+                             'temporary file by parse_multipart')
+    parser.add_argument('--upload-dir', default=tempfile.gettempdir(),
+                        help='the directory of the temporary file for --sink file')
+    parser.add_argument('--fields', type=int, default=10000)
+    args = parser.parse_args()
+
+    seconds = bench_file(args.size * MB, args.sink, args.upload_dir)
+    print 'single file: %d MB (%s) in %.2fs, %.1f MB/s, peak RSS %.1f MB' % (
+        args.size, args.sink, seconds, args.size / seconds, peak_rss_mb())
+
+    parse_seconds, read_seconds = bench_fields(args.fields)
+    print 'fields: %d fields parsed in %.3fs, read by name in %.3fs, ' \
+          'peak RSS %.1f MB' % (args.fields, parse_seconds, read_seconds, peak_rss_mb())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+The per-response overhead of Puck, with a regression budget. For every kind
+of response it measures:
+
+- the time of one request,
+- the function calls(python and builtin) made for one request, counted by
+  sys.setprofile. Unlike the time, it does not depend on the machine, so it
+  is the number the budget is checked against,
+- the objects left behind by one request, which should be 0.
+
+CPython 2 has no allocation tracer(tracemalloc is python 3 only), the calls
+are the deterministic measure of the work and the temporary objects of a
+response. Exit with 1 if any number is over BUDGET.
+
+    python benchmarks/bench_response.py
+"""
+import gc
+import os
+import sys
+import time
+import argparse
+from wsgiref.util import setup_testing_defaults
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from puck import Puck, jsonify
+from puck.response import Response
+
+# the max function calls and the max objects left behind of one request.
+BUDGET = {
+    'text': {'calls': 220, 'leaked': 0},
+    'bytes': {'calls': 220, 'leaked': 0},
+    'json': {'calls': 250, 'leaked': 0},
+    'response': {'calls': 215, 'leaked': 0},
+    'not_found': {'calls': 105, 'leaked': 0},
+}
+
+
+def make_app():
+    app = Puck(secure_key='secure_key')
+
+    @app.route('/text')
+    def text():
+        return u'hello world \xe9'
+
+    @app.route('/bytes')
+    def _bytes():
+        return 'hello world'
+
+    @app.route('/json')
+    def json():
+        return jsonify({'id': 1, 'name': 'puck', 'tags': ['a', 'b']})
+
+    @app.route('/response')
+    def response():
+        return Response(response_body='hello world', status=201,
+                        header=[('X-Request-Id', '1')], mimetype='text/plain')
+
+    return app
+
+
+PATHS = {
+    'text': '/text',
+    'bytes': '/bytes',
+    'json': '/json',
+    'response': '/response',
+    'not_found': '/missing',
+}
+
+
+def start_response(status, header_list, exc_info=None):
+    pass
+
+
+def make_request(app, path):
+    environ = {'PATH_INFO': path}
+    setup_testing_defaults(environ)
+
+    def request():
+        list(app(dict(environ), start_response))
+    return request
+
+
+def count_calls(request):
+    counter = [0]
+
+    def profile(frame, event, arg):
+        if event in ('call', 'c_call'):
+            counter[0] += 1
+
+    sys.setprofile(profile)
+    try:
+        request()
+    finally:
+        sys.setprofile(None)
+    # the call of sys.setprofile itself is counted.
+    return counter[0] - 1
+
+
+def count_leaked(request, number=1000):
+    gc.collect()
+    before = len(gc.get_objects())
+    for _ in xrange(number):
+        request()
+    gc.collect()
+    return max(len(gc.get_objects()) - before, 0) // number
+
+
+def measure_time(request, number):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for _ in xrange(number):
+            request()
+        seconds = (time.time() - start) / number
+        best = seconds if best is None else min(best, seconds)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=10000,
+                        help='the requests of every timing round')
+    args = parser.parse_args()
+
+    app = make_app()
+    print '%-10s %10s %8s %8s %s' % ('response', 'time(us)', 'calls', 'leaked', 'budget')
+    failed = False
+    for name in sorted(PATHS):
+        request = make_request(app, PATHS[name])
+        # warm up the caches, like the rendered error responses.
+        for _ in range(10):
+            request()
+        calls = count_calls(request)
+        leaked = count_leaked(request)
+        us = measure_time(request, args.number)
+        budget = BUDGET[name]
+        over = calls > budget['calls'] or leaked > budget['leaked']
+        failed = failed or over
+        print '%-10s %10.1f %8d %8d %s' % (
+            name, us, calls, leaked,
+            'OVER %(calls)d calls, %(leaked)d leaked' % budget if over else 'ok')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
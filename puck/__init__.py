@@ -39,8 +39,9 @@ __copyright__ = 'Copyright (c) 2016 Eric in NEU'
 
 
 from .app import Puck
-from .helper import jsonify, api_response, make_response
+from .helper import jsonify, jsonify_stream, api_response, make_response, \
+    stream_with_context, send_file
 from .request import Request
-from .response import Response
+from .response import Response, FileResponse
 from .globals import current_app, request, session
 from .exceptions import HTTPException
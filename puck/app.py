@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
+from threading import Lock
+
 from .request import Request
 from .response import Response
 from .routing import Router
-from .constants import HTTP_CODES
-from .session import RedisPickleSession
+from .constants import HTTP_STATUS_LINES
+from .session import RedisPickleSession, LazySession
+from .json_engine import get_json_engine
+from .cache import ResponseCache, RedisResponseCache, SingleFlight, \
+    parse_cache_option, make_cache_key, coding_key, CONTENT_CODINGS
 from .globals import request_stack, request
 
-from .exceptions import HTTPException, NotFound, MethodNotAllowed
-from .utils import local_time_2_utc, get_after_input_time
+from .exceptions import HTTPException, NotFound, MethodNotAllowed, \
+    RequestEntityTooLarge
+from .utils import local_time_2_utc, get_after_input_time, is_not_modified, \
+    parse_http_date, choose_encoding
 
 
 # the default secure key, if secure_key is not set, use this constant to set it.
@@ -20,7 +27,12 @@ class Puck(object):
     response_class = Response
 
     def __init__(self, redis_host='127.0.0.1', redis_port=6379,
-                 session_key='session_id', secure_key=None, use_api=False):
+                 session_key='session_id', secure_key=None, use_api=False,
+                 session_touch=False, session_cache=None, max_content_length=None,
+                 max_form_parts=None, max_form_field_size=None,
+                 max_form_header_size=None, max_form_memory_size=None,
+                 upload_dir=None, json_engine=None, response_cache=None,
+                 etag=False, compress=False, compress_level=6, compress_min_size=500):
 
         # the secure_key, which will be used to sign.
         self.secure_key = secure_key if secure_key else DEFAULT_SECURE_KEY
@@ -29,14 +41,52 @@ class Puck(object):
         self.session_key = session_key
 
         # the type of sessions' storage, currently Puck support to use Redis to
-        # save the session.
+        # save the session. If session_touch=True, the unmodified sessions
+        # only refresh their TTL instead of being written again. If
+        # session_cache(an instance of SessionCache) is given, the hot
+        # sessions are loaded from it instead of the redis.
         self.session_type = RedisPickleSession(
             redis_host=redis_host, redis_port=redis_port,
-            secure_key=self.secure_key, key=session_key
+            secure_key=self.secure_key, key=session_key, touch=session_touch,
+            cache=session_cache
         )
 
         self.url_handler_map = Router()
 
+        # the JSON engine used by jsonify and api_response, the name of the
+        # module like 'ujson' or an instance of JSONEngine. If it is None,
+        # use the fastest installed one.
+        self.json_engine = get_json_engine(json_engine)
+
+        # the cache of the responses of the routes which have the cache option.
+        # It is an instance of ResponseCache(default) or RedisResponseCache,
+        # 'redis' means RedisResponseCache using the redis of the sessions.
+        if response_cache is None:
+            response_cache = ResponseCache()
+        elif response_cache == 'redis':
+            response_cache = RedisResponseCache(self.session_type.redis)
+        self.response_cache = response_cache
+
+        # whether any route has the cache option.
+        self.has_cached_routes = False
+
+        # the default of the etag option of the routes. If it is True, the ETag
+        # of the response is the hash of the body. If the request has the same
+        # ETag in If-None-Match, a 304 response without body is returned.
+        self.etag = etag
+
+        # the default of the compress option of the routes. If it is True, the
+        # response is compressed by gzip or deflate which is accepted by the
+        # client. The body which is smaller than compress_min_size is not
+        # compressed.
+        self.compress = compress
+        self.compress_level = compress_level
+        self.compress_min_size = compress_min_size
+
+        # coalesce the concurrent identical GET requests of the routes which
+        # have the coalesce option.
+        self.single_flight = SingleFlight()
+
         # a list of functions that will be called before handling
         # the request. If these functions return any value, the
         # further request handling is stopped, and instance of Puck
@@ -53,6 +103,28 @@ class Puck(object):
         # if YES, set it to True, else False
         self.use_api = use_api
 
+        # the limits of the request body, the None value means using the
+        # default value of request_class. A route can override them by its
+        # options, like: @app.route('/upload', max_content_length=1024)
+        # If the body is bigger than the limits, a 413 response is returned.
+        # upload_dir is the directory of the temporary files of the uploads.
+        self.request_limits = {
+            'max_content_length': max_content_length,
+            'max_form_parts': max_form_parts,
+            'max_form_field_size': max_form_field_size,
+            'max_form_header_size': max_form_header_size,
+            'max_form_memory_size': max_form_memory_size,
+            'upload_dir': upload_dir,
+        }
+
+        # the number of the rejected requests, the key is the name of the limit.
+        self.rejected_requests = {}
+        self._rejected_lock = Lock()
+
+        # the built-in server started by run(), like an instance of
+        # KeepAliveServer, whose stats() can be read while it is serving.
+        self.server = None
+
     def route(self, url, **options):
         """Decorator for request handler. Add rules.
         Same as add_route(url, handler, **optioins)
@@ -61,6 +133,43 @@ class Puck(object):
             @app.route('/')
             def index():
                 return 'Hello world'
+
+        The HEAD requests are handled by the GET handler, and the body is
+        dropped. Give a cheaper handler by head=func, it should set the
+        Content-Length instead of making the body:
+
+            @app.route('/report', head=report_head)
+            def report():
+                return make_report()
+
+        The response of head=func(or the head() of a resource) has no body, so
+        it is neither hashed by etag=True nor compressed. Give the ETag by the
+        etag function, or set it in the head handler, so that it matches the
+        ETag of the GET response.
+
+        Cache the response of the GET requests for 60 seconds, see puck.cache:
+
+            @app.route('/articles', cache=60)
+            def articles():
+                return render_articles()
+
+        Set the ETag to the hash of the body by etag=True, and the 304 response
+        is returned if the client has the same body. Or give a function, which
+        is called with the params of the url and returns the version of the
+        response, the 304 response is returned before calling the handler:
+
+            @app.route('/article/<int:id>', etag=lambda id: get_version(id))
+            def article(id):
+                return render_article(id)
+
+        Run the handler once for the concurrent GET requests which have the
+        same path and params by coalesce=True, the other requests wait for it
+        and share its response. The handler should not depend on the user,
+        like the session:
+
+            @app.route('/ranking', coalesce=True)
+            def ranking():
+                return compute_ranking()
         """
         def wrapper(handler):
             self.add_route(url, handler, **options)
@@ -75,18 +184,22 @@ class Puck(object):
                         ONLY used when self.use_api=False
         :param resource: the instance of resource. ONLY used when self.use_api=True.
         """
+        if options.get('cache') is not None:
+            # cache=60 or cache={'ttl': 60, 'vary': ('Accept-Language',)}
+            options['cache'] = parse_cache_option(options['cache'])
+            self.has_cached_routes = True
         if self.use_api:
-            self._add_resource(url, resource)
+            self._add_resource(url, resource, **options)
         else:
             self._add_route(url, handler, **options)
 
-    def _add_resource(self, url, resource):
+    def _add_resource(self, url, resource, **options):
         """ONLY used when self.use_api=True.
 
         :param url: the route url
         :param resource: the instance of resource
         """
-        self.url_handler_map.add_resource(url, resource)
+        self.url_handler_map.add_resource(url, resource, **options)
 
     def _add_route(self, url, handler, **options):
         """ONLY used when self.use_api=False
@@ -115,6 +228,146 @@ class Puck(object):
         :return: (function, methods, params)"""
         return self.url_handler_map.match_url(url, method)
 
+    def match_rule(self, url, method):
+        """The same as match_url, but returns the matched rule too.
+
+        :return: (rule, function, params)"""
+        return self.url_handler_map.match_rule(url, method)
+
+    def get_route_etag(self, rule, params):
+        """Call the etag function of the rule to get the ETag of the response.
+
+        :return: the ETag like '"3"', or None.
+        """
+        etag = rule.options.get('etag', self.etag)
+        if not callable(etag) or request.method not in ('GET', 'HEAD'):
+            return None
+        version = etag(**params)
+        if version is None:
+            return None
+        return '"%s"' % version
+
+    def negotiate_encoding(self, rule):
+        """Choose the content coding of the response of the rule by the
+        Accept-Encoding of the request, None means no compression."""
+        if not rule.options.get('compress', self.compress):
+            return None
+        return choose_encoding(request.header.get('Accept-Encoding'))
+
+    def compress_response(self, rule, response):
+        """Compress the response if the rule has the compress option."""
+        if not rule.options.get('compress', self.compress) or \
+                not response.can_compress(self.compress_min_size):
+            return
+        response.add_vary('Accept-Encoding')
+        encoding = self.negotiate_encoding(rule)
+        if encoding is not None:
+            response.compress(encoding, self.compress_level)
+
+    def coalesce_handler(self, rule, handler, params):
+        """Call the handler once for the concurrent identical GET requests.
+        Only the response whose body is a sequence in memory and does not set
+        cookies is shared, else the waiting requests call the handler by
+        themselves. A FileResponse is never shared, its file is sent once.
+
+        :return: the response, a new instance of response_class if it is shared.
+        """
+        def call():
+            response = self.make_response(handler(**params))
+            if not response.is_sequence or response._cookies or \
+                    'Set-Cookie' in response.header:
+                return response, None
+            body = ''.join(response.encode_body(response.response))
+            response.response = [body]
+            return response, (response.status, response.header.head_to_list(), body)
+
+        key = make_cache_key(rule.rule_name, request.path, request.request_params, ())
+        (response, entry), shared = self.single_flight.do(key, call)
+        if not shared:
+            return response
+        if entry is None:
+            return handler(**params)
+        status, header_list, body = entry
+        return self.response_class(status=status, header=list(header_list),
+                                   response_body=[body])
+
+    def get_cache_key(self, rule):
+        """Make the key of the cached response of the current request, None
+        means that the response of the rule is not cached."""
+        cache = rule.options.get('cache')
+        if cache is None or request.method not in ('GET', 'HEAD'):
+            return None
+        _, vary = cache
+        headers = request.header
+        values = [headers.get(name, '') for name in vary]
+        key = make_cache_key(rule.rule_name, request.path, request.request_params, values)
+        # keep the compressed variants apart.
+        return coding_key(key, self.negotiate_encoding(rule))
+
+    def lookup_cache(self):
+        """Find the cached response of the current request.
+
+        :return: the entry(status, header_list, body) or None.
+        """
+        try:
+            rule, _, _ = self.match_rule(request.path, request.method)
+        except HTTPException:
+            return None
+        key = self.get_cache_key(rule)
+        if key is None:
+            return None
+        return self.response_cache.get(key)
+
+    def cache_response(self, rule, response):
+        """Store the response of a GET request if the rule has the cache option.
+        Only the 200 responses which have a known length and do not set
+        cookies are stored. The vary headers of the rule are in the Vary of
+        the response, so they are sent with the cached response too.
+
+        :return: the stored entry(status, header_list, body) or None.
+        """
+        cache = rule.options.get('cache')
+        if cache is None or request.method != 'GET' or \
+                response.status[:3] != '200' or not response.is_sequence or \
+                response._cookies or 'Set-Cookie' in response.header:
+            return None
+        header_list = response.get_header_list()
+        entry = (response.status, header_list, ''.join(response.response))
+        self.response_cache.set(
+            self.get_cache_key(rule), entry, cache[0], route=rule.rule_name)
+        return entry
+
+    def invalidate_cache(self, route=None, key=None):
+        """Delete the cached responses.
+
+        :param route: the name of the route(the rule_name, default is the name
+                      of the handler or the class of the resource), delete all
+                      of its responses.
+        :param key: the key made by make_cache_key, delete this response and
+                    all of its compressed variants.
+        If both are None, clear the whole cache.
+        """
+        if route is not None:
+            self.response_cache.delete_route(route)
+        if key is not None:
+            for encoding in CONTENT_CODINGS:
+                self.response_cache.delete(coding_key(key, encoding))
+        if route is None and key is None:
+            self.response_cache.clear()
+
+    def reject_request(self, limit):
+        """Count the request which is rejected by the limit of the body."""
+        with self._rejected_lock:
+            self.rejected_requests[limit] = self.rejected_requests.get(limit, 0) + 1
+
+    def rejection_stats(self):
+        """Return a copy of the number of the rejected requests, like:
+
+            {'max_content_length': 3, 'max_form_parts': 1}
+        """
+        with self._rejected_lock:
+            return dict(self.rejected_requests)
+
     def process_before_request(self):
         """Called the functions before dispatching the request url, which
         uses "@before_request" to decorate function. All these functions
@@ -132,14 +385,14 @@ class Puck(object):
         """This function will be called after handling the request
         and make the response.All these functions
         are stored in a list named "after_request_funcs.
-        If the session is not None, the session will be saved.
+        If the session has been used in this request, the session will be saved.
 
         :param response: the ojbect of response. Always the return
                          value of make_respose
         """
         _session = request_stack.top.session
-        if _session is not None:
-            self.save_session(_session, response)
+        if _session is not None and _session.is_loaded:
+            self.save_session(_session.get_real_session(), response)
         for func in self.after_request_funcs:
             response = func(response)
         return response
@@ -174,6 +427,9 @@ class Puck(object):
 
         1. if the param response is a tuple, this func will create an instance of Response
         2. Set the status of the instance of Response.
+
+        If the handler returns a generator or an iterator, it is the body of a
+        streamed response, which is sent chunk by chunk without buffering.
         """
         status = header = None
 
@@ -191,7 +447,7 @@ class Puck(object):
             if isinstance(status, basestring):
                 response.status = status
             else:
-                response.status = '%d %s' % (status, HTTP_CODES[status])
+                response.status = HTTP_STATUS_LINES[status]
 
         return response
 
@@ -212,27 +468,117 @@ class Puck(object):
         """WSGI interface. The server will call the instance of Puck, use
         this function to handling request. """
         with _RequestStack(self, environ):
-            result = self.process_before_request()
-            if result is None:
-                request_url = request.path
-                request_method = request.method
-
-                try:
-                    handler, params = self.match_url(request_url, request_method)
-                    result = handler(**params)
-                    # result = self.handle(handler, methods, request_method, params)
-                except HTTPException as ex_response:
-                    return ex_response(environ, start_response)
+            matched_rule = None
+            # whether the response is made by the head option of the rule.
+            head_only = False
+            try:
+                request.set_limits(self.request_limits)
+                if self.has_cached_routes:
+                    entry = self.lookup_cache()
+                    if entry is not None:
+                        return send_cached_response(entry, environ, start_response)
+
+                result = self.process_before_request()
+                if result is None:
+                    request_url = request.path
+                    request_method = request.method
+
+                    rule, handler, params = self.match_rule(request_url, request_method)
+                    if request_method == 'HEAD' and rule.options.get('head'):
+                        handler = rule.options['head']
+                        head_only = True
+                    request.set_limits(rule.options)
+                    # reject the too large body before the handler reads it.
+                    request.check_content_length()
+                    etag = self.get_route_etag(rule, params)
+                    if etag is not None and is_not_modified(environ, etag):
+                        result = self.response_class(status=304, header=[('ETag', etag)])
+                    elif rule.options.get('coalesce') and request_method == 'GET':
+                        result = self.coalesce_handler(rule, handler, params)
+                        matched_rule = rule
+                    else:
+                        result = handler(**params)
+                        # result = self.handle(handler, methods, request_method, params)
+                        matched_rule = rule
+            except HTTPException as ex_response:
+                if isinstance(ex_response, RequestEntityTooLarge):
+                    self.reject_request(ex_response.limit)
+                return ex_response(environ, start_response)
 
             response = self.make_response(result)
             response = self.process_after_request(response)
+            if matched_rule is not None:
+                if etag is not None and 'ETag' not in response.header:
+                    response.header.add('ETag', etag)
+                elif matched_rule.options.get('etag', self.etag) is True and \
+                        not head_only:
+                    response.add_etag()
+                cache = matched_rule.options.get('cache')
+                if cache is not None:
+                    # the response differs by the headers in the cache key.
+                    for name in cache[1]:
+                        response.add_vary(name)
+                if not head_only:
+                    self.compress_response(matched_rule, response)
+                elif matched_rule.options.get('compress', self.compress):
+                    response.add_vary('Accept-Encoding')
+                if self.has_cached_routes:
+                    entry = self.cache_response(matched_rule, response)
+                    if entry is not None:
+                        return send_cached_response(entry, environ, start_response)
+            response.make_conditional(environ)
             return response(environ, start_response)
 
-    def run(self, host='127.0.0.1', port=8888, **options):
-        # options.setdefault('use_server', 'WSGIrefServer')
-        from server import WSGIrefServer
-        httpd = WSGIrefServer(host=host, port=port, **options)
-        httpd.run(self)
+    def run(self, host='127.0.0.1', port=8888, server=None, workers=None,
+            threads=None, **options):
+        """Start the built-in server.
+
+        :param server: the name of the server('wsgiref', 'threadpool', 'prefork',
+                       'keepalive', 'gevent') or a subclass of BaseServer. If it
+                       is None, use 'prefork' when workers is given, 'threadpool'
+                       when threads is given, else 'wsgiref'.
+        :param workers: the number of the worker processes, used by 'prefork'.
+        :param threads: the number of the threads in each process, used by
+                        'threadpool', 'keepalive' and 'prefork'.
+
+        The server is kept in self.server, so its statistics can be read from
+        the other threads, like app.server.stats() of 'keepalive'.
+        """
+        from .server import get_server
+        server_class = get_server(server, workers=workers, threads=threads)
+        for name, value in (('workers', workers), ('threads', threads)):
+            if value is None:
+                continue
+            if name not in server_class.run_options:
+                raise ValueError('%s does not support the %s option.'
+                                 % (server_class.__name__, name))
+            options[name] = value
+        self.server = server_class(host=host, port=port, **options)
+        self.server.run(self)
+
+
+def send_cached_response(entry, environ, start_response):
+    """Send the cached entry(status, header_list, body)."""
+    status, header_list, body = entry
+    if 'HTTP_IF_NONE_MATCH' in environ or 'HTTP_IF_MODIFIED_SINCE' in environ:
+        validators = dict(
+            (name.lower(), value) for name, value in header_list
+            if name.lower() in ('etag', 'last-modified')
+        )
+        if validators and is_not_modified(
+                environ, validators.get('etag'),
+                parse_http_date(validators.get('last-modified'))):
+            start_response(HTTP_STATUS_LINES[304], [
+                (name, value) for name, value in header_list
+                if name.lower() != 'content-length'
+            ])
+            return []
+
+    # the server may change the header list, give it a copy.
+    start_response(status, list(header_list))
+    if environ['REQUEST_METHOD'] == 'HEAD':
+        return []
+    return [body]
 
 
 class _RequestStack(object):
@@ -243,12 +589,13 @@ class _RequestStack(object):
             xxx
             xxx
     Use this context, it will push the current app, the current request and the session
-    into the LocalStack
+    into the LocalStack. The session is a LazySession, it will not be loaded until
+    it is used.
     """
     def __init__(self, app, environ):
         self.app = app
         self.request = app.request_class(environ)
-        self.session = app.get_session(self.request)
+        self.session = LazySession(lambda: app.get_session(self.request))
 
     def __enter__(self):
         request_stack.push(self)
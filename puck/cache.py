@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+The response cache of the routes. Add a route with the cache option:
+
+    @app.route('/articles', cache=60)
+    def articles():
+        ...
+
+    @app.route('/feed', cache={'ttl': 300, 'vary': ('Accept-Language',)})
+    def feed():
+        ...
+
+The finished response(status, header list and encoded body) of a GET request
+is stored, and the next GET or HEAD request with the same key is answered from
+the cache without running the before_request functions, the handler and the
+after_request functions. The key is made of the route, the path, the sorted
+request params and the values of the 'vary' headers, and the compressed
+variants are stored under the key plus the content coding, see coding_key.
+Only the 200 responses with a known length and without Set-Cookie are stored.
+
+SingleFlight coalesces the concurrent identical requests of the routes with
+the coalesce option, see Puck.route.
+"""
+import sys
+import time
+import cPickle as pickle
+from urllib import urlencode
+from collections import OrderedDict
+from threading import Lock, Event
+
+
+def parse_cache_option(value):
+    """Parse the cache option of a route.
+
+    :param value: the seconds to keep the response, or a dict like
+                  {'ttl': 60, 'vary': ('Accept-Language',)}
+    :return: (ttl, vary), vary is a tuple of the header names.
+    """
+    if isinstance(value, dict):
+        ttl = value.get('ttl', 60)
+        vary = tuple(value.get('vary', ()))
+    else:
+        ttl = value
+        vary = ()
+    if not isinstance(ttl, (int, long, float)) or ttl <= 0:
+        raise ValueError('The ttl of the cache should be a positive number.')
+    return ttl, vary
+
+
+def make_cache_key(route, path, params, headers):
+    """Make the key of the response.
+
+    :param route: the name of the route
+    :param path: the path of the request
+    :param params: the request params, a dict
+    :param headers: the values of the vary headers
+    """
+    query = urlencode(sorted(params.iteritems()), doseq=True) if params else ''
+    return '\x00'.join((route, path, query) + tuple(headers))
+
+
+# the content codings of the stored responses, '' means not compressed.
+CONTENT_CODINGS = ('', 'gzip', 'deflate')
+
+
+def coding_key(key, encoding=None):
+    """Make the key of one content coding variant of the response.
+
+    :param key: the key made by make_cache_key
+    :param encoding: the content coding, None means not compressed.
+    """
+    return '%s\x00%s' % (key, encoding or '')
+
+
+class ResponseCache(object):
+    """A bounded in-process LRU cache of the responses. The least recently used
+    entries are evicted when the size of the bodies and headers is over
+    max_bytes. Every entry expires after its own ttl.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 64):
+        """Init the cache.
+
+        :param max_bytes: the max size of the cached responses.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> (expire_time, size, route, entry)
+        self._data = OrderedDict()
+        # route -> the set of the keys
+        self._routes = {}
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the entry(status, header_list, body), or None if it is not
+        cached."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[0] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            # move it to the end, the most recently used one.
+            del self._data[key]
+            self._data[key] = item
+            self.hits += 1
+        return item[3]
+
+    def set(self, key, entry, ttl, route=None):
+        """Store the entry(status, header_list, body) for ttl seconds."""
+        status, header_list, body = entry
+        size = len(key) + len(body) + sum(
+            len(name) + len(value) for name, value in header_list)
+        if size > self.max_bytes:
+            return
+        item = (time.time() + ttl, size, route, entry)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = item
+            self.size += size
+            self._routes.setdefault(route, set()).add(key)
+            self.stores += 1
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is None:
+            return
+        self.size -= item[1]
+        keys = self._routes.get(item[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._routes[item[2]]
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_route(self, route):
+        """Delete all of the responses of the route."""
+        with self._lock:
+            for key in list(self._routes.get(route, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._routes.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return the statistics of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+class RedisResponseCache(object):
+    """Store the responses in the redis, so that they are shared between the
+    processes and the servers. Usually it uses the redis connection of
+    RedisSession: Puck(response_cache='redis').
+    """
+
+    # the prefix of the keys in the redis
+    prefix = 'puck:cache:'
+
+    def __init__(self, redis, prefix=None):
+        """Init the cache.
+
+        :param redis: the StrictRedis object
+        :param prefix: the prefix of the keys in the redis
+        """
+        self.redis = redis
+        if prefix is not None:
+            self.prefix = prefix
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _route_key(self, route):
+        return '%sroute:%s' % (self.prefix, route)
+
+    def get(self, key):
+        data = self.redis.get(self.prefix + key)
+        if data is None:
+            self._incr('misses')
+            return None
+        self._incr('hits')
+        return pickle.loads(data)
+
+    def set(self, key, entry, ttl, route=None):
+        ttl = max(int(ttl), 1)
+        pipe = self.redis.pipeline()
+        pipe.setex(self.prefix + key, ttl, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+        if route is not None:
+            # remember the keys of the route, so they can be deleted together.
+            route_key = self._route_key(route)
+            pipe.sadd(route_key, key)
+            pipe.expire(route_key, ttl)
+        pipe.execute()
+        self._incr('stores')
+
+    def delete(self, key):
+        self.redis.delete(self.prefix + key)
+
+    def delete_route(self, route):
+        """Delete all of the responses of the route."""
+        route_key = self._route_key(route)
+        keys = self.redis.smembers(route_key)
+        self.redis.delete(route_key, *[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(self.prefix + '*'))
+        if keys:
+            self.redis.delete(*keys)
+
+    def stats(self):
+        """Return the statistics of this process."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+class _Flight(object):
+    """One in-flight call of SingleFlight."""
+
+    __slots__ = ('event', 'result', 'exc_info')
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """Coalesce the concurrent calls with the same key: the first call runs the
+    function, the others wait for it and share its result. The error of the
+    call is raised in all of its waiters, but it is not kept, the next call
+    runs the function again.
+
+    It uses the threading primitives, which are patched by gevent, so it works
+    with the threads and the greenlets.
+    """
+
+    def __init__(self):
+        # key -> the in-flight call
+        self._flights = {}
+        self._lock = Lock()
+
+        self.executions = 0
+        # the number of the duplicate executions saved
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func(*args, **kwargs), or wait for the in-flight call with the
+        same key.
+
+        :return: (result, shared), shared is True if the result comes from
+                 the other call.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            flight.event.wait()
+            if flight.exc_info is not None:
+                exc_type, exc_value, exc_tb = flight.exc_info
+                raise exc_type, exc_value, exc_tb
+            return flight.result, True
+
+        try:
+            flight.result = func(*args, **kwargs)
+        except BaseException:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.result, False
+
+    def stats(self):
+        """Return the statistics of the calls."""
+        return {
+            'executions': self.executions,
+            'shared': self.shared,
+            'in_flight': len(self._flights),
+        }
@@ -66,3 +66,9 @@ HTTP_CODES = {
     507:    'Insufficient Storage',
     510:    'Not Extended'
 }
+
+# the status lines, like {200: '200 OK'}, so that they are not formatted for
+# every response.
+HTTP_STATUS_LINES = dict(
+    (code, '%d %s' % (code, message)) for code, message in HTTP_CODES.iteritems()
+)
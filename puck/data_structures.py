@@ -1,8 +1,14 @@
 # -*— coding:utf-8 -*-
+import os
 from warnings import warn
+from tempfile import SpooledTemporaryFile, NamedTemporaryFile
 
 CHUNK_SIZE = 1024 * 10
 
+# the umask of the process, used to set the mode of the moved upload file.
+_umask = os.umask(0)
+os.umask(_umask)
+
 
 def http_key(key):
     """content-type --> Content-Type"""
@@ -16,81 +22,120 @@ class Header(object):
     2. DO NOT Supply a dict or list object, but gives key-value pairs
     3. Supply a list object
 
+    It is an ordered multidict, the same key can be added more than once,
+    like 'Set-Cookie'. The lookups use a hash index instead of scanning
+    the list. If base=True(HTTP header), the keys are case-insensitive,
+    else(form and file) the keys are exact.
+
     Data-structure:
     self._list = [(key1, value1), (key2, value2), ...]
+    self._index = {index_key1: [the positions of key1 in self._list], ...}
     """
     def __init__(self, _dict_list=None, base=True, *args, **kwargs):
         # self._list = [(key, value), (key, value), ...]
         self._list = []
 
+        # the index of self._list, the value is the list of the positions
+        # which are in ascending order.
+        self._index = {}
+
         # Flag for judge whether this class is used to be a instance of HTTP Header.
         # Currently, it is useful when Header class is used in request._form and request._file
         self.base = base
 
         if not _dict_list:
             for key, value in dict(*args, **kwargs).iteritems():
-                self._list.append((key, value))
+                self.add(key, value)
         elif isinstance(_dict_list, dict):
             for key, value in _dict_list.iteritems():
-                self._list.append((key, value))
+                self.add(key, value)
         elif isinstance(_dict_list, list):
-            self._list.extend(_dict_list)
+            for key, value in _dict_list:
+                self.add(key, value)
         else:
             warn(
                 'The response head is initialized to None, '
                 'because the param is not dict or list.', UserWarning
             )
 
+    def _index_key(self, key):
+        """content_type, Content-Type --> content-type if base=True"""
+        if self.base:
+            return key.replace('_', '-').lower()
+        return key
+
+    def _reindex(self):
+        self._index = index = {}
+        for _id, (key, _) in enumerate(self._list):
+            index.setdefault(self._index_key(key), []).append(_id)
+
     def __setitem__(self, key, value):
         if isinstance(key, int):
             self._list[key] = value
+            self._reindex()
+            return
+
+        positions = self._index.get(self._index_key(key))
+        if positions:
+            _id = positions[0]
+            self._list[_id] = (self._list[_id][0], str(value))
         else:
-            key = http_key(key) if self.base else key
-            for _id, (_key, _value) in enumerate(self._list):
-                if _key == key:
-                    self._list[_id] = (_key, str(_value))
-                    break
-            else:
-                self.add(key, str(value))
+            self.add(http_key(key) if self.base else key, str(value))
 
     def __getitem__(self, item):
         if isinstance(item, int):
             return self._list[item]
-        item = http_key(item) if self.base else item
-        for key, value in self._list:
-            if key == item:
-                return value
+        return self.get(item)
 
     def __delitem__(self, key):
         if isinstance(key, int):
             del self._list[key]
         else:
-            key = http_key(key) if self.base else key
-            for _id, _key, _value in enumerate(self._list):
-                if key == _key:
-                    del self._list[_id]
+            index_key = self._index_key(key)
+            if index_key not in self._index:
+                return
+            self._list = [
+                item for item in self._list
+                if self._index_key(item[0]) != index_key
+            ]
+        self._reindex()
+
+    def __contains__(self, key):
+        return self._index_key(key) in self._index
+
+    def __len__(self):
+        return len(self._list)
 
     def __iter__(self):
         return iter(self._list)
 
     def add(self, key, value):
+        self._index.setdefault(self._index_key(key), []).append(len(self._list))
         self._list.append((key, value))
 
-    def get(self, key):
-        key = http_key(key) if self.base else key
-        for _key, _value in self._list:
-            if _key == key:
-                return _value
-        return None
+    def get(self, key, default=None):
+        positions = self._index.get(self._index_key(key))
+        if positions:
+            return self._list[positions[0]][1]
+        return default
+
+    def get_all(self, key):
+        """Return all the values of the key, like the values of 'Set-Cookie'."""
+        _list = self._list
+        return [_list[_id][1] for _id in self._index.get(self._index_key(key), ())]
 
     def head_to_list(self, charset='utf-8'):
         result = []
-        for key, value in self:
-            if isinstance(value, unicode):
-                value = value.encode(charset)
-            else:
-                value = str(value)
-            result.append((key, value))
+        for item in self._list:
+            value = item[1]
+            if type(value) is not str:
+                if isinstance(value, unicode):
+                    value = value.encode(charset)
+                else:
+                    value = str(value)
+                item = (item[0], value)
+            # the tuple is reused when the value is a str already.
+            result.append(item)
         return result
 
     def __str__(self):
@@ -118,6 +163,12 @@ class EnvironHeader(object):
             return self.environ[item]
         return self.environ['HTTP_' + item]
 
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
     def __iter__(self):
         for key, value in self.environ.iteritems():
             if key.startswith('HTTP_') and \
@@ -182,6 +233,93 @@ class IterStream(object):
         return self._pos >= self.end
 
 
+class FileWrapper(object):
+    """The wsgi.file_wrapper of the built-in servers. It iterates over the file
+    block by block, and can be limited to a part of the file, which is used
+    by the Range requests. The servers send it by sendfile if possible.
+    """
+
+    def __init__(self, filelike, blksize=CHUNK_SIZE, offset=None, length=None):
+        """Init the FileWrapper.
+
+        :param filelike: the file to be sent
+        :param blksize: the size of every block
+        :param offset: the position to start, None means the current position.
+        :param length: the size to be sent, None means to the end of the file.
+        """
+        self.filelike = filelike
+        self.blksize = blksize
+        if offset is not None:
+            filelike.seek(offset)
+        self.offset = filelike.tell() if hasattr(filelike, 'tell') else 0
+        self.remaining = length
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        size = self.blksize
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                raise StopIteration()
+            size = min(size, self.remaining)
+        data = self.filelike.read(size)
+        if not data:
+            raise StopIteration()
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+
+class SpooledUploadFile(SpooledTemporaryFile):
+    """Store the uploaded file in memory until its size exceeds max_size, then
+    spill it into a named temporary file on disk. Because the file on disk has
+    a name, it can be moved to the destination without copying the data.
+    If max_size <= 0, the data is written to disk from the start.
+    """
+
+    def __init__(self, *args, **kwargs):
+        SpooledTemporaryFile.__init__(self, *args, **kwargs)
+        # SpooledTemporaryFile never rolls over when max_size is 0.
+        if self._max_size <= 0:
+            self.rollover()
+
+    def rollover(self):
+        if self._rolled:
+            return
+        memory_file = self._file
+        mode, bufsize, suffix, prefix, _dir = self._TemporaryFileArgs
+        new_file = self._file = NamedTemporaryFile(
+            mode=mode, bufsize=bufsize, suffix=suffix, prefix=prefix, dir=_dir)
+        del self._TemporaryFileArgs
+
+        new_file.write(memory_file.getvalue())
+        new_file.seek(memory_file.tell(), 0)
+        self._rolled = True
+
+    def move_to(self, destination):
+        """Rename the temporary file to destination, and close this file.
+
+        :return: True if the file has been moved, False if the data is still in
+                 memory, or the destination is on another filesystem.
+        """
+        if not self._rolled:
+            return False
+        temp_file = self._file
+        temp_file.flush()
+        try:
+            os.rename(temp_file.name, destination)
+        except OSError:
+            return False
+        # the temporary file is gone, do not delete it when closing.
+        temp_file.delete = False
+        os.chmod(destination, 0o666 & ~_umask)
+        self.close()
+        return True
+
+
 class File(object):
 
     def __init__(self, stream, file_name, content_type='application/octet-stream'):
@@ -199,7 +337,15 @@ class File(object):
             yield data
 
     def create(self, destination):
-        """Create a new file, and set data of the stream into the file."""
+        """Create a new file, and set data of the stream into the file.
+        If the data has been spilled into a temporary file on the same
+        filesystem, the temporary file is renamed to destination, the data
+        is not copied.
+        """
+        move_to = getattr(self.stream, 'move_to', None)
+        if move_to is not None and move_to(destination):
+            return
+
         with open(destination, 'w+b') as f:
             for data in self.read_data_from_stream(self.stream):
                 f.write(data)
@@ -2,11 +2,50 @@
 from .response import Response
 from .helper import api_response
 from .constants import HTTP_CODES
+from .globals import request_stack
+
+
+# the rendered error responses, {key: (status, header_list, body)}, see
+# HTTPException.cache_key.
+_rendered_responses = {}
+
+# the max number of the rendered error responses to be cached, the errors
+# with the varying messages are not cached over this.
+MAX_RENDERED_RESPONSES = 256
+
+# the methods which render the response, if a subclass of HTTPException
+# overrides any of them, its responses are not cached.
+_rendering_methods = ('make_header', 'make_response_body', 'make_response',
+                      'render')
+
+# {the subclass of HTTPException: whether it uses the default rendering}
+_default_rendering = {}
+
+
+def clear_rendered_responses():
+    """Clear the cache of the rendered error responses. Call it after
+    changing how the errors are rendered."""
+    _rendered_responses.clear()
+    _default_rendering.clear()
+
+
+def _uses_default_rendering(cls):
+    result = _default_rendering.get(cls)
+    if result is None:
+        result = _default_rendering[cls] = all(
+            getattr(cls, name).__func__ is getattr(HTTPException, name).__func__
+            for name in _rendering_methods
+        )
+    return result
 
 
 class HTTPException(Exception):
     """A base Exception class"""
 
+    # whether to cache the rendered response. The status line, headers and
+    # body of the same error are rendered only once.
+    cache_response = True
+
     def __init__(self, status_code, message=None, use_api_response=True):
         Exception.__init__(self, status_code, message)
         self.use_api_response = use_api_response
@@ -47,7 +86,11 @@ class HTTPException(Exception):
             response_body=response_body
         )
 
-    def __call__(self, environ, start_response):
+    def render(self):
+        """Render the response.
+
+        :return: (status, header_list, body), body is a list of str.
+        """
         if self.use_api_response:
             response = api_response(
                 status_code=self.status_code,
@@ -56,7 +99,44 @@ class HTTPException(Exception):
             )
         else:
             response = self.make_response()
-        return response(environ, start_response)
+        header_list = response.get_header_list()
+        return response.status, header_list, response.encode_body(response.response)
+
+    def cache_key(self):
+        """The key of the rendered response in the cache, None means that
+        it should not be cached. The api response depends on the application,
+        so the application, its response_class and json_engine are in the key.
+        """
+        cls = self.__class__
+        if not self.cache_response or not _uses_default_rendering(cls):
+            return None
+        key = (cls, self.status_code, self.message, self.use_api_response)
+        if self.use_api_response:
+            top = request_stack.top
+            if top is None:
+                return None
+            app = top.app
+            key += (app, app.response_class, app.json_engine)
+        try:
+            hash(key)
+        except TypeError:   # like a dict message
+            return None
+        return key
+
+    def __call__(self, environ, start_response):
+        key = self.cache_key()
+        rendered = None if key is None else _rendered_responses.get(key)
+        if rendered is None:
+            rendered = self.render()
+            if key is not None and len(_rendered_responses) < MAX_RENDERED_RESPONSES:
+                _rendered_responses[key] = rendered
+
+        status, header_list, body = rendered
+        # the server may change the header list, give it a copy.
+        start_response(status, list(header_list))
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return body
 
 
 class BadRequest(HTTPException):
@@ -118,6 +198,21 @@ class MethodNotAllowed(HTTPException):
         )
 
 
+class RequestEntityTooLarge(HTTPException):
+    """413: Request Entity Too Large
+
+    Raise if the request body is bigger than the limits of the application
+    or the route. The name of the limit is stored in 'limit', like
+    'max_content_length', 'max_form_parts', 'max_form_field_size' or
+    'max_form_header_size'.
+    """
+    def __init__(self, message=None, use_api_response=True, limit=None):
+        super(RequestEntityTooLarge, self).__init__(
+            413, message=message, use_api_response=use_api_response
+        )
+        self.limit = limit
+
+
 class InternalServerError(HTTPException):
     """500: Internal Server Error
 
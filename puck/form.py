@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 import urlparse
-import tempfile
 
 from .utils import parse_header_line, parse_dict_string, parse_multipart_headers
-from .data_structures import IterStream, File, Header
+from .data_structures import IterStream, File, Header, SpooledUploadFile, CHUNK_SIZE
+from .exceptions import RequestEntityTooLarge, BadRequest
+
+
+# the uploaded file which is smaller than this size is kept in memory,
+# the bigger one is written into a temporary file.
+MAX_MEMORY_FILE_SIZE = 1024 * 500
+
+# the max size of the headers of one part of a multipart body.
+MAX_HEADER_SIZE = 1024 * 8
 
 
 def valid_boundary(s, _vb_pattern="^[ -~]{0,200}[!-~]$"):
@@ -12,7 +20,28 @@ def valid_boundary(s, _vb_pattern="^[ -~]{0,200}[!-~]$"):
     return re.match(_vb_pattern, s)
 
 
-def parse_form_data(environ):
+def check_content_length(environ, max_content_length=None):
+    """Raise RequestEntityTooLarge if the Content-Length of the request is
+    bigger than max_content_length, so the body is never read. Raise
+    BadRequest if the Content-Length is not a number or negative, it must
+    never be passed to read(), read(-1) reads to the end of the stream.
+
+    :return the content length of the request.
+    """
+    try:
+        content_length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise BadRequest('Invalid Content-Length.')
+    if content_length < 0:
+        raise BadRequest('Invalid Content-Length.')
+    if max_content_length is not None and content_length > max_content_length:
+        raise RequestEntityTooLarge(limit='max_content_length')
+    return content_length
+
+
+def parse_form_data(environ, max_memory_size=MAX_MEMORY_FILE_SIZE,
+                    max_content_length=None, max_parts=None, max_field_size=None,
+                    max_header_size=None, upload_dir=None):
     """Parse data from environ when requests are PUT or POST. That is, this function will
     be called when the request is POST or PUT.
     1. When ' Content-Type = multipart/form-data ', there is always having files in the form.
@@ -20,22 +49,34 @@ def parse_form_data(environ):
     in the form
 
     :param environ: the WSGI environment
+    :param max_memory_size: the uploaded file which is bigger than this size will be
+                            written into a temporary file.
+    :param max_content_length: the max size of the body.
+    :param max_parts: the max number of the parts of the multipart body.
+    :param max_field_size: the max size of a form field which is not a file.
+    :param max_header_size: the max size of the headers of one part.
+    :param upload_dir: the directory of the temporary files of the uploads,
+                       None means the default temporary directory.
 
     :return (form, file)
             form is a list, which structure likes [(key1, val1), (key2, val2), (key3, val3), ...]
             file is a list, which structure likes [(name1, File object1), (name2, File object2), ...]
     """
-    content_length = int(environ['CONTENT_LENGTH'] or 0)
+    content_length = check_content_length(environ, max_content_length)
     content_type, flag = parse_header_line(environ['CONTENT_TYPE'])
 
     if content_type == 'multipart/form-data':
         # POST or PUT Request submit a form, may have a file.
         _form, _file = parse_multipart(
-            environ['wsgi.input'], content_length, flag.get('boundary')
+            environ['wsgi.input'], content_length, flag.get('boundary'),
+            max_memory_size=max_memory_size, max_parts=max_parts,
+            max_field_size=max_field_size, max_header_size=max_header_size,
+            upload_dir=upload_dir
         )
 
     elif content_type == 'application/x-www-form-urlencoded':
         # POST or PUT Request just submit a form, without a file.
+        # the content_length has been checked, so the read is bounded.
         _form = read_urlencoded(environ['wsgi.input'].read(content_length))
         _file = None
     else:
@@ -44,7 +85,225 @@ def parse_form_data(environ):
     return _form, _file
 
 
-def parse_multipart(file, content_length, boundary):
+class MultipartParser(object):
+    """Parse the multipart body chunk by chunk, it never reads a whole line of
+    the body, so the memory is bounded no matter how the data looks like.
+    Iterate over the instance to get the events:
+
+        ('headers', (header_list, header_dict))   the start of a part, the
+                                                   headers are the same as the
+                                                   result of parse_multipart_headers
+        ('data', chunk)                            a piece of the body of the part
+        ('end', None)                              the end of the part
+
+    The body of a part ends with a delimiter: CRLF + '--' + boundary. The parser
+    reads fixed size chunks, and searches the delimiter with str.find. The
+    data before the delimiter is sent out at once, only the tail which may be
+    the beginning of a delimiter is kept in the buffer.
+    """
+
+    def __init__(self, stream, boundary, chunk_size=CHUNK_SIZE, max_parts=None,
+                 max_header_size=None):
+        """Init the parser.
+
+        :param stream: the stream has a read method, Usually is an instance of
+                       IterStream, so it never reads over the Content-Length.
+        :param boundary: the boundary of the multipart body
+        :param chunk_size: the size to read from the stream every time.
+        :param max_parts: the max number of the parts, if there are more parts,
+                          RequestEntityTooLarge is raised.
+        :param max_header_size: the max size of the headers of one part, if
+                                they are larger, RequestEntityTooLarge is
+                                raised. None means MAX_HEADER_SIZE.
+        """
+        self._read = stream.read
+        self.chunk_size = chunk_size
+        self.max_parts = max_parts
+        self.max_header_size = MAX_HEADER_SIZE if max_header_size is None \
+            else max_header_size
+        # LF is enough to find the delimiter, the CR before it is removed
+        # from the data, so a body ending with LF only is accepted too.
+        self.delimiter = '\n--' + boundary
+        # the first boundary has no line break before it.
+        self.buf = '\r\n'
+
+    def _fill(self):
+        chunk = self._read(self.chunk_size)
+        if not chunk:
+            raise ValueError('Unexpected end of multipart data.')
+        self.buf += chunk
+
+    def _read_line(self):
+        """Read one line of the headers, which is limited by max_header_size."""
+        pos = self.buf.find('\n')
+        while pos < 0:
+            if len(self.buf) > self.max_header_size:
+                raise RequestEntityTooLarge(limit='max_form_header_size')
+            self._fill()
+            pos = self.buf.find('\n')
+        line, self.buf = self.buf[:pos + 1], self.buf[pos + 1:]
+        return line
+
+    def _read_headers(self):
+        lines = []
+        size = 0
+        while True:
+            line = self._read_line()
+            size += len(line)
+            if size > self.max_header_size:
+                raise RequestEntityTooLarge(limit='max_form_header_size')
+            if line in ('\r\n', '\n'):
+                lines.append(line)
+                return parse_multipart_headers(lines)
+            lines.append(line)
+
+    def __iter__(self):
+        delimiter = self.delimiter
+        # keep this size of the tail in the buffer, it may be the start of the
+        # delimiter and the CR before it.
+        keep = len(delimiter)
+        in_part = False
+        parts = 0
+
+        while True:
+            pos = self.buf.find(delimiter)
+            if pos < 0:
+                if len(self.buf) > keep:
+                    if in_part:
+                        yield 'data', self.buf[:-keep]
+                    # else it is the preamble before the first boundary, drop it.
+                    self.buf = self.buf[-keep:]
+                self._fill()
+                continue
+
+            if in_part:
+                end = pos - 1 if pos and self.buf[pos - 1] == '\r' else pos
+                if end:
+                    yield 'data', self.buf[:end]
+                yield 'end', None
+                in_part = False
+            self.buf = self.buf[pos + len(delimiter):]
+
+            while len(self.buf) < 2:
+                self._fill()
+            if self.buf[:2] == '--':    # the last boundary
+                return
+
+            parts += 1
+            if self.max_parts is not None and parts > self.max_parts:
+                raise RequestEntityTooLarge(limit='max_form_parts')
+
+            self._read_line()   # the rest of the boundary line
+            yield 'headers', self._read_headers()
+            in_part = True
+
+
+def get_part_content_type(header_list, default=None):
+    """Get the Content-Type of a part from its header list, like
+    ['Content-Disposition: form-data', 'Content-Type: image/png'].
+
+    :param default: the value returned if there is no Content-Type.
+    """
+    for line in header_list[1:]:
+        key, value = parse_dict_string(line, use_tuple=True)
+        if key.lower() == 'content-type':
+            return value
+    return default
+
+
+class MultipartPart(object):
+    """One part of a multipart body, which is given by iter_multipart.
+    Iterate over it to get the body of the part chunk by chunk. The chunks
+    can only be read before moving to the next part.
+    """
+
+    def __init__(self, header_list, header_dict, chunks):
+        # the headers of the part, like ['Content-Disposition: form-data', ...]
+        self.headers = header_list
+        self.name = header_dict.get('name')
+        self.filename = header_dict.get('filename')
+        self.content_type = get_part_content_type(header_list)
+        self._chunks = chunks
+
+    @property
+    def is_file(self):
+        return self.filename is not None
+
+    def __iter__(self):
+        return self._chunks
+
+    def read(self):
+        """Read the whole body of the part."""
+        return ''.join(self._chunks)
+
+    def close(self):
+        """Stop reading, the rest of the body will be skipped."""
+        self._chunks.close()
+
+    def __repr__(self):
+        return '<%s: %r (%r)>' % (
+            self.__class__.__name__,
+            self.name,
+            self.filename
+        )
+
+
+def _iter_part_data(events):
+    """Yield the data of the current part from the events of MultipartParser."""
+    for event, value in events:
+        if event != 'data':
+            return
+        yield value
+
+
+def iter_multipart(file, content_length, boundary, chunk_size=CHUNK_SIZE,
+                   max_parts=None, max_header_size=None):
+    """Parse the multipart body while it arrives. It is a generator, yields an
+    instance of MultipartPart for every part, so the body can be hashed,
+    proxied or written to the final place without a temporary file:
+
+        for part in iter_multipart(environ['wsgi.input'], length, boundary):
+            if part.is_file:
+                with open(part.filename, 'wb') as f:
+                    for chunk in part:
+                        f.write(chunk)
+
+    The body of a part which is not read is skipped. It never reads over
+    content_length.
+
+    :param file: the file will be parsed. Usually the file is environ['wsgi.input']
+    :param content_length: the length of the file
+    :param boundary: the delimiter used in 'multipart/form-data'
+    :param chunk_size: the size to read from the file every time.
+    :param max_parts: the max number of the parts.
+    :param max_header_size: the max size of the headers of one part.
+    """
+    if not boundary:
+        raise ValueError('Missing boundary, which is necessary.')
+    if not valid_boundary(boundary):
+        raise ValueError('Invalid boundary in multipart form.')
+
+    file = IterStream(file, content_length)
+    events = iter(MultipartParser(
+        file, boundary, chunk_size, max_parts, max_header_size))
+    for event, value in events:
+        if event != 'headers':  # the data of the part which is not read
+            continue
+        sub_header_list, sub_header_dict = value
+        if not sub_header_list or \
+                sub_header_list[0] != 'Content-Disposition: form-data':
+            raise ValueError('Missing Content-Disposition header.')
+
+        part = MultipartPart(
+            sub_header_list, sub_header_dict, _iter_part_data(events))
+        yield part
+        # the user asks for the next part, stop reading this one.
+        part.close()
+
+
+def parse_multipart(file, content_length, boundary,
+                    max_memory_size=MAX_MEMORY_FILE_SIZE, max_parts=None,
+                    max_field_size=None, max_header_size=None, upload_dir=None):
     """Parse file to form and file. Only called when ' Content-Type = multipart/form-data '
 
     The Request always like following block(leave out some unnecessary information.), Note
@@ -63,10 +322,22 @@ def parse_multipart(file, content_length, boundary):
     PNG ... content of chrome.png ...
     ------WebKitFormBoundaryrGKCBY7qhFd3TrwA--      (-----------> last_boundary)
 
+    The data is parsed by MultipartParser chunk by chunk, the body of the file
+    is written piece by piece into a SpooledUploadFile, which is kept in memory
+    until it is bigger than max_memory_size. Put the temporary files in
+    upload_dir, on the same filesystem as the destination of File.create, so
+    that the file is moved by renaming instead of copying.
+
     :param file: the file will be parsed. Usually the file is environ['wsgi.input']
     :param content_length: the length of the file
     :param boundary: the delimiter used in 'multipart/form-data', use this to split
                      key-value pairs
+    :param max_memory_size: the max size of the file which is kept in memory.
+    :param max_parts: the max number of the parts.
+    :param max_field_size: the max size of a form field which is not a file.
+    :param max_header_size: the max size of the headers of one part.
+    :param upload_dir: the directory of the temporary files, None means the
+                       default temporary directory.
 
     :return (form, file)
             form is a list, which structure likes [(key1, val1), (key2, val2), (key3, val3), ...]
@@ -76,72 +347,54 @@ def parse_multipart(file, content_length, boundary):
         raise ValueError('Missing boundary, which is necessary.')
     if not valid_boundary(boundary):
         raise ValueError('Invalid boundary in multipart form.')
-    real_boundary = '--' + boundary
-    last_boundary = real_boundary + '--'
 
     file = IterStream(file, content_length)
     _form = Header(base=False)
     _file = Header(base=False)
 
-    exit_flag = False
-
-    line = file.next().rstrip()      # boundary
-
-    if line != real_boundary:
-        raise ValueError('Cannot found boundary in the start of data.')
-
-    while not exit_flag:
-        # sub_header = file.next()    # Content-Disposition: form-data; name="file"; filename="chrome.png"
-        # sub_header = parse_header_line(sub_header)
-        sub_header_list, sub_header_dict = parse_multipart_headers(file)
-        if sub_header_list[0] != 'Content-Disposition: form-data':
-            raise ValueError('Missing Content-Disposition header.')
-
-        name = sub_header_dict.get('name')
-        filename = sub_header_dict.get('filename')
-
-        if filename is None:
-            is_file = False
-            container = []
-            _write = container.append
-        else:
-            is_file = True
-            # content_type = parse_dict_string(parse_header_line(file.next())[0]).get('Content-Type')
-            content_type = parse_dict_string(sub_header_list[1])
-            container = tempfile.TemporaryFile('wb+')
-            _write = container.write
-
-        buf = ''
-        for line in file:
-            if line[:2] == '--':
-                line = line.rstrip()
-                if line == real_boundary:
-                    break
-                if line == last_boundary:
-                    exit_flag = True
-                    break
-
-            # if not line:    # blank line
-            #     continue
-
-            if buf:
-                _write(buf)
-                buf = ''
-
-            if line[-2:] == '\r\n':
-                buf = '\r\n'
-                _write(line[:-2])
-            elif line[-1:] == '\n':
-                buf = '\n'
-                _write(line[:-1])
+    # the state of the current part, set by its headers.
+    name = filename = content_type = container = _write = None
+    is_file = False
+    field_size = 0
+
+    parser = MultipartParser(file, boundary, max_parts=max_parts,
+                             max_header_size=max_header_size)
+    for event, value in parser:
+        if event == 'data':
+            if not is_file and max_field_size is not None:
+                field_size += len(value)
+                if field_size > max_field_size:
+                    raise RequestEntityTooLarge(limit='max_form_field_size')
+            _write(value)
+
+        elif event == 'headers':
+            sub_header_list, sub_header_dict = value
+            if not sub_header_list or \
+                    sub_header_list[0] != 'Content-Disposition: form-data':
+                raise ValueError('Missing Content-Disposition header.')
+
+            name = sub_header_dict.get('name')
+            filename = sub_header_dict.get('filename')
+
+            if filename is None:
+                is_file = False
+                field_size = 0
+                container = []
+                _write = container.append
             else:
-                _write(line)
-
-        if is_file:
-            container.seek(0)
-            _file.add(name, File(container, filename, content_type))
-        else:
-            _form.add(name, ''.join(container))
+                is_file = True
+                content_type = get_part_content_type(
+                    sub_header_list, 'application/octet-stream')
+                container = SpooledUploadFile(
+                    max_size=max_memory_size, mode='w+b', dir=upload_dir)
+                _write = container.write
+
+        else:   # the end of the part
+            if is_file:
+                container.seek(0)
+                _file.add(name, File(container, filename, content_type))
+            else:
+                _form.add(name, ''.join(container))
 
     return _form, _file
 
@@ -28,6 +28,12 @@ class Proxy(object):
     def __setitem__(self, key, value):
         self._get_real_object().__setitem__(key, value)
 
+    def __delitem__(self, key):
+        self._get_real_object().__delitem__(key)
+
+    def __contains__(self, item):
+        return item in self._get_real_object()
+
 
 request_stack = LocalStack()
 current_app = Proxy(lambda: request_stack.top.app)
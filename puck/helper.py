@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-from .globals import current_app
-import simplejson as json
+from .globals import current_app, request_stack
+from .response import FileResponse
+from .json_engine import default_engine
 
 
 def make_response(*args):
@@ -13,19 +14,74 @@ def make_response(*args):
     return current_app.make_response(args)
 
 
+def stream_with_context(generator):
+    """The body of a streamed response is iterated after the handler returns,
+    the request, session and current_app are not available there. Wrap the
+    generator to keep them:
+
+        @app.route('/export')
+        def export():
+            def generate():
+                for row in query(request.request_params):
+                    yield ','.join(row) + '\\n'
+            return Response(response_body=stream_with_context(generate()),
+                            mimetype='text/csv')
+    """
+    top = request_stack.top
+
+    def wrapper():
+        request_stack.push(top)
+        try:
+            for item in generator:
+                yield item
+        finally:
+            request_stack.pop()
+            close = getattr(generator, 'close', None)
+            if close is not None:
+                close()
+    return wrapper()
+
+
+def send_file(file, mimetype=None, as_attachment=False, filename=None):
+    """Send a file, the params are the same as FileResponse.
+
+        @app.route('/report')
+        def report():
+            return send_file('/data/report.pdf', as_attachment=True)
+    """
+    return FileResponse(file, mimetype=mimetype, filename=filename,
+                        as_attachment=as_attachment)
+
+
 def dumps(obj, **kwargs):
-    kwargs.setdefault('ensure_ascii', False)
-    js = json.dumps(obj, **kwargs)
-    if isinstance(js, unicode):
-        js.encode('utf-8')
-    return js
+    """Serialize obj to a utf-8 encoded JSON str by the default engine."""
+    return default_engine.dumps(obj, **kwargs)
 
 
 def jsonify(*args, **kwargs):
     """ Create a instance of Response,
     and setting the mimetype='application/json' """
+    if len(args) == 1 and not kwargs and isinstance(args[0], dict):
+        obj = args[0]
+    else:
+        obj = dict(*args, **kwargs)
+    return current_app.response_class(
+        response_body=current_app.json_engine.dumps(obj),
+        mimetype='application/json'
+    )
+
+
+def jsonify_stream(iterable):
+    """Create a streamed response of a JSON array, the items are encoded
+    one by one while the response is being sent, so a large list is never
+    held in memory:
+
+        @app.route('/users')
+        def users():
+            return jsonify_stream(user.to_dict() for user in query_users())
+    """
     return current_app.response_class(
-        response_body=dumps(dict(*args, **kwargs)),
+        response_body=current_app.json_engine.iterencode(iterable),
         mimetype='application/json'
     )
 
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+The JSON engines used by jsonify, api_response and the HTTP exceptions.
+The first installed one of ENGINE_NAMES is used by default:
+
+- ujson: the fastest, written in C.
+- simplejson: with the C speedups.
+- json: the standard library.
+
+All of the engines output the utf-8 encoded str, so the response body is
+not encoded again.
+"""
+
+# the names of the engines, in the order of preference.
+ENGINE_NAMES = ('ujson', 'simplejson', 'json')
+
+
+class JSONEngine(object):
+    """Wrap a JSON module, which has a dumps function."""
+
+    def __init__(self, module):
+        self.module = module
+        self.name = module.__name__
+        # ujson has no JSONEncoder, and does not support the other kwargs.
+        self.is_ujson = self.name == 'ujson'
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a utf-8 encoded str.
+
+        :param kwargs: the kwargs of json.dumps, like indent. If ujson does not
+                       support them, the standard library is used.
+        """
+        if self.is_ujson:
+            if kwargs:
+                return _stdlib_engine().dumps(obj, **kwargs)
+            js = self.module.dumps(obj, ensure_ascii=False,
+                                   escape_forward_slashes=False)
+        else:
+            kwargs.setdefault('ensure_ascii', False)
+            js = self.module.dumps(obj, **kwargs)
+        if isinstance(js, unicode):
+            js = js.encode('utf-8')
+        return js
+
+    def iterencode(self, iterable):
+        """Serialize an iterable into a JSON array item by item, so that the
+        large list can be sent while it is being encoded. It is a generator,
+        yields utf-8 encoded str.
+        """
+        dumps = self.dumps
+        yield '['
+        first = True
+        for item in iterable:
+            if first:
+                first = False
+                yield dumps(item)
+            else:
+                yield ',' + dumps(item)
+        yield ']'
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.name)
+
+
+def _stdlib_engine():
+    import json
+    return JSONEngine(json)
+
+
+def get_json_engine(name=None):
+    """Get the JSON engine.
+
+    :param name: the name of the module like 'ujson', or an instance of
+                 JSONEngine. If it is None, use the first installed one of
+                 ENGINE_NAMES.
+    """
+    if isinstance(name, JSONEngine):
+        return name
+    for engine_name in (name,) if name else ENGINE_NAMES:
+        try:
+            module = __import__(engine_name)
+        except ImportError:
+            if name:
+                raise
+            continue
+        return JSONEngine(module)
+
+
+# the engine used when there is no application, like helper.dumps
+default_engine = get_json_engine()
@@ -5,7 +5,6 @@ except ImportError:
     get_current_greenlet = int
 
 from thread import get_ident as get_current_thread
-from threading import Lock
 
 
 if get_current_greenlet is int:  # Use thread
@@ -15,81 +14,68 @@ else:   # Use greenlet
 
 
 class Local(object):
-    __slots__ = ('__data__', '__lock__')
+    """Store the attributes for every thread(or greenlet) separately.
+
+    There is no lock here. The data of every thread(or greenlet) is a dict
+    in __data__, keyed by its ident, and only the owner reads or writes it.
+    The single dict operations are atomic under the GIL, so reading an
+    attribute never waits for the other threads.
+    """
+    __slots__ = ('__data__',)
 
     def __init__(self):
         object.__setattr__(self, '__data__', {})
-        object.__setattr__(self, '__lock__', Lock())
 
     def __iter__(self):
         return self.__data__.iteritems()
 
     def __getattr__(self, item):
-        self.__lock__.acquire()
         try:
-            try:
-                return self.__data__[get_ident()][item]
-            except KeyError:
-                raise AttributeError(item)
-        finally:
-            self.__lock__.release()
+            return self.__data__[get_ident()][item]
+        except KeyError:
+            raise AttributeError(item)
 
     def __setattr__(self, key, value):
-        self.__lock__.acquire()
+        _id = get_ident()
+        data = self.__data__
         try:
-            _id = get_ident()
-            data = self.__data__
-            if _id in data:
-                data[_id][key] = value
-            else:
-                data[_id] = {key: value}
-        finally:
-            self.__lock__.release()
+            data[_id][key] = value
+        except KeyError:
+            data[_id] = {key: value}
 
     def __delattr__(self, item):
-        self.__lock__.acquire()
         try:
-            try:
-                del self.__data__[get_ident()][item]
-            except KeyError:
-                raise AttributeError(item)
-        finally:
-            self.__lock__.release()
+            del self.__data__[get_ident()][item]
+        except KeyError:
+            raise AttributeError(item)
 
     def __release__(self):
         self.__data__.pop(get_ident(), None)
 
 
 class LocalStack(object):
+    """A stack in Local. Every thread(or greenlet) has its own stack, so
+    push and pop do not need a lock."""
 
     def __init__(self):
         self._local = Local()
-        self._lock = Lock()
 
     def push(self, obj):
-        self._lock.acquire()
-        try:
-            rv = getattr(self._local, 'stack', None)
-            if rv is None:
-                self._local.stack = rv = []
-            rv.append(obj)
-            return rv
-        finally:
-            self._lock.release()
+        rv = getattr(self._local, 'stack', None)
+        if rv is None:
+            self._local.stack = rv = []
+        rv.append(obj)
+        return rv
 
     def pop(self):
-        self._lock.acquire()
-        try:
-            stack = getattr(self._local, 'stack', None)
-            if stack is None:
-                return None
-            elif len(stack) == 1:
-                self._local.__release__()
-                return stack[-1]
-            else:
-                stack.pop()
-        finally:
-            self._lock.release()
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            return None
+        elif len(stack) == 1:
+            self._local.__release__()
+            return stack[-1]
+        else:
+            return stack.pop()
 
     @property
     def top(self):
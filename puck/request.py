@@ -4,10 +4,11 @@ try:
 except ImportError:
     from cgi import parse_qs
 
-from .data_structures import EnvironHeader
+from .data_structures import EnvironHeader, Header
 from .cookies import parse_cookie
-from .form import parse_form_data
-from .utils import lazy_property
+from .form import parse_form_data, iter_multipart, check_content_length, \
+    MAX_MEMORY_FILE_SIZE, MAX_HEADER_SIZE
+from .utils import lazy_property, parse_header_line
 
 
 def get_host(environ):
@@ -29,9 +30,52 @@ def get_host(environ):
 
 class BaseRequest(object):
 
+    # the uploaded file which is bigger than this size will be written into
+    # a temporary file, the smaller one is kept in memory.
+    max_form_memory_size = MAX_MEMORY_FILE_SIZE
+
+    # the max size of the request body, None means no limit. If the
+    # Content-Length is bigger than it, RequestEntityTooLarge is raised
+    # before the body is read.
+    max_content_length = None
+
+    # the max number of the parts of a multipart body, None means no limit.
+    max_form_parts = None
+
+    # the max size of a form field which is not a file, None means no limit.
+    max_form_field_size = None
+
+    # the max size of the headers of one part of a multipart body.
+    max_form_header_size = MAX_HEADER_SIZE
+
+    # the directory of the temporary files of the uploads, None means the
+    # default temporary directory. Use the filesystem of the destination, so
+    # that File.create moves the file instead of copying it.
+    upload_dir = None
+
+    # the names of the limits, which can be set by Puck or the route options.
+    limit_names = ('max_content_length', 'max_form_parts', 'max_form_field_size',
+                   'max_form_header_size', 'max_form_memory_size', 'upload_dir')
+
     def __init__(self, environ):
         self.environ = environ
 
+    def set_limits(self, limits):
+        """Set the limits of the request body. They are checked when the body
+        is read, call check_content_length to reject the request earlier.
+
+        :param limits: a dict like {'max_content_length': 1024}, the keys
+                       which are not in limit_names are ignored.
+        """
+        for name in self.limit_names:
+            if limits.get(name) is not None:
+                setattr(self, name, limits[name])
+
+    def check_content_length(self):
+        """Raise RequestEntityTooLarge if the Content-Length is bigger than
+        max_content_length."""
+        return check_content_length(self.environ, self.max_content_length)
+
     @lazy_property
     def method(self):
         return self.environ.get('REQUEST_METHOD', 'get').upper()
@@ -73,6 +117,15 @@ class BaseRequest(object):
     def content_type(self):
         return self.environ.get('CONTENT_TYPE', '')
 
+    @lazy_property
+    def data(self):
+        """The raw body of the request, like a json body. It is limited by
+        max_content_length."""
+        content_length = self.check_content_length()
+        if not content_length:
+            return ''
+        return self.environ['wsgi.input'].read(content_length)
+
     @lazy_property
     def request_params(self):
         """return the request params. Example:
@@ -102,7 +155,7 @@ class BaseRequest(object):
 
         d = self.__dict__
         if '_form' not in d:
-            d['_form'], d['_file'] = parse_form_data(self.environ)
+            d['_form'], d['_file'] = self._parse_form_data()
         return self._form
 
     @lazy_property
@@ -112,9 +165,47 @@ class BaseRequest(object):
 
         d = self.__dict__
         if '_file' not in d:
-            d['_form'], d['_file'] = parse_form_data(self.environ)
+            d['_form'], d['_file'] = self._parse_form_data()
         return self._file
 
+    def _parse_form_data(self):
+        return parse_form_data(
+            self.environ, self.max_form_memory_size,
+            max_content_length=self.max_content_length,
+            max_parts=self.max_form_parts,
+            max_field_size=self.max_form_field_size,
+            max_header_size=self.max_form_header_size,
+            upload_dir=self.upload_dir
+        )
+
+    def iter_parts(self):
+        """Read the multipart body part by part while it arrives, instead of
+        buffering the whole body like request.form and request.file. It is a
+        generator, yields an instance of MultipartPart, iterate over the part
+        to get its body chunk by chunk:
+
+            for part in request.iter_parts():
+                for chunk in part:
+                    sha.update(chunk)
+
+        The body can only be read once, after calling this method,
+        request.form and request.file are empty.
+        """
+        content_type, flag = parse_header_line(self.content_type)
+        if content_type != 'multipart/form-data':
+            raise ValueError('The request body is not multipart/form-data.')
+
+        d = self.__dict__
+        if '_form' in d:
+            raise RuntimeError('The request body has been read.')
+
+        content_length = self.check_content_length()
+        d['_form'], d['_file'] = Header(base=False), Header(base=False)
+        return iter_multipart(
+            self.environ['wsgi.input'], content_length, flag.get('boundary'),
+            max_parts=self.max_form_parts,
+            max_header_size=self.max_form_header_size)
+
 
 class Request(BaseRequest):
     pass
@@ -1,11 +1,33 @@
 # -*- coding: utf-8 -*-
+import os
+import zlib
+import uuid
+import hashlib
 import warnings
+import mimetypes
 from Cookie import SimpleCookie
 
-from .data_structures import Header
-from .utils import generate_content_type
+from .data_structures import Header, FileWrapper, CHUNK_SIZE
+from .utils import generate_content_type, http_date, parse_http_date, \
+    parse_range_header, is_not_modified
 from .cookies import generate_cookie
-from .constants import HTTP_CODES
+from .constants import HTTP_STATUS_LINES
+
+
+# the mimetypes which are compressed, besides text/*, */*+json and */*+xml
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'application/json',
+    'application/javascript',
+    'application/x-javascript',
+    'application/xml',
+    'image/svg+xml',
+])
+
+
+def is_compressible_mimetype(content_type):
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES or \
+        mimetype.endswith('+json') or mimetype.endswith('+xml')
 
 
 class BaseResponse(object):
@@ -19,6 +41,9 @@ class BaseResponse(object):
     # the default status code if there is not given
     default_status = 200
 
+    # whether the body can be compressed by Puck
+    compressible = True
+
     def __init__(self, status=default_status, response_body=None, header=None,
                  mimetype=None, content_type=None):
         if isinstance(header, Header):
@@ -53,20 +78,23 @@ class BaseResponse(object):
             # Ex: status = 200
             try:
                 # self.status_code = int(status)
-                self.status = '%d %s' % (int(status), HTTP_CODES[int(status)])
+                self.status = HTTP_STATUS_LINES[int(status)]
             except TypeError:
                 # self.status_code = self.default_status
-                self.status = '%d %s' % (
-                    self.default_status, HTTP_CODES[self.default_status])
+                self.status = HTTP_STATUS_LINES[self.default_status]
                 warnings.warn(
                     'Status code is initialized to 200, Because the '
                     'status code should be int.',
                     UserWarning
                 )
 
-        # Get the response body
+        # Get the response body. A string body is stored in a list, so that
+        # it is a sequence, the Content-Length can be computed and the body is
+        # sent in one piece, not one character at a time.
         if response_body is None:
             self.response = []
+        elif isinstance(response_body, basestring):
+            self.response = [response_body]
         else:
             self.response = response_body
 
@@ -74,6 +102,13 @@ class BaseResponse(object):
     def is_sequence(self):
         return isinstance(self.response, (list, tuple))
 
+    @property
+    def is_streamed(self):
+        """If the body is a generator or an iterator, the length is unknown,
+        the body is sent chunk by chunk without Content-Length, and the
+        server frames it(like chunked transfer encoding in HTTP/1.1)."""
+        return not self.is_sequence
+
     @property
     def cookies(self):
         """self._cookies is a dict, key: cookie name, value: a instance of Morsel."""
@@ -123,37 +158,175 @@ class BaseResponse(object):
     #     """Create a cookies attribute for response."""
     #     return self.cookies.append(SimpleCookie(mosel.output()))
 
-    def get_header_list(self):
+    def get_header_list(self, content_length=True):
         """Turn the response header into a list. The header is a instance of Header,
         use this func to get attribute which name is ' _list '.
+
+        :param content_length: whether to count the Content-Length of the body.
         """
-        for item in self.cookies:
-            self.header.add('Set-Cookie', self.cookies[item].OutputString())
-        if self.is_sequence and 'Content-Length' not in self.header:
-            try:
-                content_length = sum((len(str(item))) for item in self.response)
-            except UnicodeError:
-                pass
-            else:
-                self.header.add('Content-Length', str(content_length))
+        if self._cookies:
+            for item in self._cookies:
+                self.header.add('Set-Cookie', self._cookies[item].OutputString())
+        if self.is_sequence:
+            # encode the body once, the length is taken from the result,
+            # and the encoded items are sent untouched.
+            body = self.response = self.encode_body(self.response)
+            if content_length and 'Content-Length' not in self.header and \
+                    self.status[:3] not in ('204', '304'):
+                self.header.add('Content-Length', str(sum(map(len, body))))
         return self.header.head_to_list(charset=self.charset)
 
+    def encode_body(self, body):
+        """Encode the items of the body into str. The body is returned as it is
+        if it is a list of str already."""
+        if type(body) is list:
+            for item in body:
+                if type(item) is not str:
+                    break
+            else:
+                return body
+
+        charset = self.charset
+        result = []
+        for item in body:
+            if type(item) is not str:
+                if isinstance(item, unicode):
+                    item = item.encode(charset)
+                else:
+                    item = str(item)
+            result.append(item)
+        return result
+
+    def add_etag(self):
+        """Set the ETag to the hash of the encoded body, only for the body
+        which is a sequence."""
+        if not self.is_sequence or 'ETag' in self.header:
+            return
+        body = self.response = self.encode_body(self.response)
+        self.header.add('ETag', '"%s"' % hashlib.md5(''.join(body)).hexdigest())
+
+    def make_conditional(self, environ):
+        """Change the response into 304 Not Modified if the client has the same
+        response, which is checked by ETag and Last-Modified.
+
+        :return: True if the response is changed.
+        """
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD') or \
+                self.status[:3] != '200':
+            return False
+        header = self.header
+        if 'ETag' not in header and 'Last-Modified' not in header:
+            return False
+        if not is_not_modified(environ, header.get('ETag'),
+                               parse_http_date(header.get('Last-Modified'))):
+            return False
+
+        self.status = HTTP_STATUS_LINES[304]
+        if 'Content-Length' in header:
+            del header['Content-Length']
+        close = getattr(self.response, 'close', None)
+        if close is not None:
+            close()
+        self.response = []
+        return True
+
+    def add_vary(self, name):
+        """Add the name of the request header to the Vary header."""
+        vary = self.header.get('Vary')
+        if not vary:
+            self.header['Vary'] = name
+        elif name.lower() not in [item.strip().lower() for item in vary.split(',')]:
+            self.header['Vary'] = '%s, %s' % (vary, name)
+
+    def can_compress(self, min_size=0):
+        """Whether the body should be compressed. The body which is small,
+        compressed already or not text is not compressed.
+
+        :param min_size: the min size of the body to be compressed, only for the
+                         body which is a sequence.
+        """
+        if not self.compressible or self.status[:3] != '200' or \
+                'Content-Encoding' in self.header or \
+                not is_compressible_mimetype(self.header.get('Content-Type') or ''):
+            return False
+        if self.is_sequence:
+            self.response = self.encode_body(self.response)
+            return sum(map(len, self.response)) >= min_size
+        return True
+
+    def compress(self, encoding, level=6):
+        """Compress the body. The body which is a sequence is compressed in one
+        pass, the streamed body is compressed chunk by chunk while it is sent.
+
+        :param encoding: 'gzip' or 'deflate'
+        :param level: the compression level, from 1(fastest) to 9(smallest).
+        """
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        header = self.header
+        if self.is_sequence:
+            data = compressor.compress(''.join(self.encode_body(self.response)))
+            data += compressor.flush()
+            self.response = [data]
+            if 'Content-Length' in header:
+                header['Content-Length'] = str(len(data))
+        else:
+            self.response = self._iter_compressed(self._iter_body(self.response),
+                                                  compressor)
+        header['Content-Encoding'] = encoding
+        # the compressed body is not the same bytes, but the same content.
+        etag = header.get('ETag')
+        if etag and not etag.startswith('W/'):
+            header['ETag'] = 'W/' + etag
+
+    def _iter_compressed(self, body, compressor):
+        try:
+            for chunk in body:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            body.close()
+
+    def has_body(self, environ):
+        """The responses of HEAD, 1xx, 204 and 304 have no body."""
+        status_code = int(self.status[:3])
+        return not (environ['REQUEST_METHOD'] == 'HEAD' or
+                    100 <= status_code < 200 or status_code in (204, 304))
+
     def iterable_item(self, environ):
         """ Generate a iterable object, and use this object to return.
 
         :param environ: the WSGI environment
         :return: a iterable response
         """
-        status_code = int(self.status[:3])
-        if environ['REQUEST_METHOD'] == 'HEAD' or \
-                    100 <= status_code < 200 or status_code in (204, 304):
-            yield ()
+        if not self.has_body(environ):
+            # never serialize the body, even it is a generator.
+            close = getattr(self.response, 'close', None)
+            if close is not None:
+                close()
+            return ()
+        if self.is_sequence:
+            return self.encode_body(self.response)
+        return self._iter_body(self.response)
 
-        for item in self.response:
-            if isinstance(item, unicode):
-                yield item.encode(self.charset)
-            else:
-                yield str(item)
+    def _iter_body(self, body):
+        try:
+            for item in body:
+                # the encoded chunks are sent untouched.
+                if type(item) is str:
+                    yield item
+                elif isinstance(item, unicode):
+                    yield item.encode(self.charset)
+                else:
+                    yield str(item)
+        finally:
+            # the server closes this generator when the client goes away or
+            # the body is sent, close the streamed body too.
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
 
     def wsgi_response(self, environ):
         """Return the WSGI response as a tuple.
@@ -164,8 +337,12 @@ class BaseResponse(object):
                  the response status, like '200 OK', the last one is the list of the
                  response header.
         """
+        # the body of a HEAD response is dropped, but the Content-Length is
+        # still counted from it, unless the head handler gives no body.
+        content_length = environ['REQUEST_METHOD'] != 'HEAD' or bool(self.response)
+        header_list = self.get_header_list(content_length)
         obj_iter = self.iterable_item(environ)
-        return obj_iter, self.status, self.get_header_list()
+        return obj_iter, self.status, header_list
 
     def __call__(self, environ, start_response):
         """Make instance of Response class as a WSGI application.
@@ -183,3 +360,167 @@ class BaseResponse(object):
 
 class Response(BaseResponse):
     pass
+
+
+class FileResponse(Response):
+    """Send a file. Content-Length, Last-Modified and ETag come from the stat
+    of the file. The file is wrapped by environ['wsgi.file_wrapper'], so the
+    built-in servers send it by sendfile. The Range requests are answered with
+    206 Partial Content, and multiple ranges with multipart/byteranges.
+
+        @app.route('/download/<str:name>')
+        def download(name):
+            return FileResponse(os.path.join(FILE_DIR, name), as_attachment=True)
+    """
+
+    # if a request asks for more ranges than this, send the whole file.
+    max_ranges = 16
+
+    # the file is sent as it is, so that sendfile and Range work.
+    compressible = False
+
+    # the body is the file, not a sequence in memory, so it is neither hashed,
+    # cached nor shared by the coalesced requests.
+    is_sequence = False
+
+    def __init__(self, file, mimetype=None, filename=None, as_attachment=False,
+                 status=200, header=None, block_size=CHUNK_SIZE):
+        """Init the FileResponse.
+
+        :param file: the path of the file, or a file object opened in binary mode.
+        :param mimetype: if it is None, guess it by the filename.
+        :param filename: the filename used to guess the mimetype and in the
+                         Content-Disposition, default is the name of the file.
+        :param as_attachment: if True, the browser downloads it instead of
+                              showing it.
+        :param block_size: the size of every block when sending the file.
+        """
+        if isinstance(file, basestring):
+            filename = filename or file
+            file = open(file, 'rb')
+        elif filename is None:
+            filename = getattr(file, 'name', None)
+            if not isinstance(filename, basestring):
+                filename = None
+
+        if mimetype is None:
+            if filename:
+                mimetype = mimetypes.guess_type(filename)[0]
+            mimetype = mimetype or 'application/octet-stream'
+        super(FileResponse, self).__init__(
+            status=status, response_body=[], header=header, mimetype=mimetype
+        )
+
+        self.file = file
+        self.block_size = block_size
+        self.etag = None
+        self.last_modified = None
+        try:
+            stat = os.fstat(file.fileno())
+        except (AttributeError, IOError, OSError, ValueError):
+            # like a StringIO
+            file.seek(0, 2)
+            self.size = file.tell()
+        else:
+            self.size = stat.st_size
+            self.last_modified = int(stat.st_mtime)
+            self.etag = '"%x-%x"' % (int(stat.st_mtime * 1000), stat.st_size)
+
+        self.header['Accept-Ranges'] = 'bytes'
+        if self.last_modified is not None:
+            self.header['Last-Modified'] = http_date(self.last_modified)
+        if self.etag is not None and 'ETag' not in self.header:
+            self.header.add('ETag', self.etag)
+        if as_attachment and filename:
+            self.header['Content-Disposition'] = \
+                'attachment; filename="%s"' % os.path.basename(filename)
+
+    def get_ranges(self, environ):
+        """Get the ranges of the request, None means to send the whole file.
+
+        :return None or a list of (start, end), end is exclusive.
+        """
+        if int(self.status[:3]) != 200 or \
+                environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return None
+        ranges = parse_range_header(environ.get('HTTP_RANGE'), self.size)
+        if ranges is None or len(ranges) > self.max_ranges:
+            return None
+
+        # If-Range: send the ranges only if the file is not changed.
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range:
+            if if_range.startswith('"') or if_range.startswith('W/'):
+                if if_range != self.etag:
+                    return None
+            elif self.last_modified is None or \
+                    parse_http_date(if_range) != self.last_modified:
+                return None
+        return ranges
+
+    def wrap_file(self, environ, offset, length):
+        """Wrap the part of the file to be sent."""
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and file_wrapper is not FileWrapper and \
+                offset == 0 and length == self.size:
+            # the wrapper of the other servers can only send the whole file.
+            self.file.seek(0)
+            return file_wrapper(self.file, self.block_size)
+        return FileWrapper(self.file, self.block_size, offset, length)
+
+    def iter_byteranges(self, ranges, part_headers, boundary):
+        try:
+            for (start, end), part_header in zip(ranges, part_headers):
+                yield part_header
+                for data in FileWrapper(self.file, self.block_size, start, end - start):
+                    yield data
+            yield '\r\n--%s--\r\n' % boundary
+        finally:
+            self.file.close()
+
+    def wsgi_response(self, environ):
+        if self.status[:3] == '304':
+            self.file.close()
+            return [], self.status, self.get_header_list()
+
+        ranges = self.get_ranges(environ)
+
+        if ranges is None:
+            self.header['Content-Length'] = str(self.size)
+            body = self.wrap_file(environ, 0, self.size)
+
+        elif not ranges:
+            self.status = HTTP_STATUS_LINES[416]
+            self.header['Content-Range'] = 'bytes */%d' % self.size
+            self.header['Content-Length'] = '0'
+            self.file.close()
+            body = []
+
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status = HTTP_STATUS_LINES[206]
+            self.header['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, self.size)
+            self.header['Content-Length'] = str(end - start)
+            body = self.wrap_file(environ, start, end - start)
+
+        else:
+            boundary = uuid.uuid4().hex
+            content_type = self.header['Content-Type']
+            part_headers = [
+                '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    boundary, content_type, start, end - 1, self.size)
+                for start, end in ranges
+            ]
+            content_length = sum(len(part_header) for part_header in part_headers) + \
+                sum(end - start for start, end in ranges) + len(boundary) + 8
+            self.status = HTTP_STATUS_LINES[206]
+            self.header['Content-Type'] = 'multipart/byteranges; boundary=%s' % boundary
+            self.header['Content-Length'] = str(content_length)
+            body = self.iter_byteranges(ranges, part_headers, boundary)
+
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            if hasattr(body, 'close'):
+                body.close()
+            self.file.close()
+            body = []
+        return body, self.status, self.get_header_list()
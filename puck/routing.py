@@ -24,6 +24,17 @@ _type_map = {
     'str': r'(?=.*[a-z])[\w-]+',
 }
 
+# the same patterns as _type_map, but used to match ONE segment of the url.
+# the lookahead of 'str' is checked by RuleDispatcher, because it looks at
+# the rest of the url, not only the segment.
+_segment_re_map = {
+    'int': re.compile(r'\d+$'),
+    'float': re.compile(r'\d+(?:\.\d+)$'),
+    'str': re.compile(r'[\w-]+$'),
+}
+
+_lower_re = re.compile(r'[a-z]')
+
 
 def parse_rule(rule):
     """Parse the rule of url. This func is a generater.
@@ -48,12 +59,16 @@ def parse_rule(rule):
 
 class Rule(object):
 
-    def __init__(self, rule_str, rule_name=None, methods=('GET',)):
+    def __init__(self, rule_str, rule_name=None, methods=('GET',), options=None):
         if not rule_str.startswith('/'):
             raise ValueError('urls must start with a leading slash')
         # the origin url rule string.
         self.rule = rule_str
 
+        # the other options given when adding the route, like the limits
+        # of the request body: {'max_content_length': 1024}
+        self.options = options or {}
+
         # the list to store the variable-type pair.
         # Can use this list to build url. Example:
         # [('example', None), ('test', <type 'int'>), ('test2', <type 'int'>)]
@@ -190,6 +205,151 @@ class Rule(object):
         pass
 
 
+class _RuleNode(object):
+    """One node of the segment trie in RuleDispatcher."""
+    __slots__ = ('static', 'dynamic', 'rules', 'min_order')
+
+    def __init__(self):
+        # the children of the static segments: {'example': _RuleNode(), ...}
+        self.static = {}
+
+        # the children of the dynamic segments: {'int': _RuleNode(), ...}
+        self.dynamic = {}
+
+        # the rules which end at this node: [(order, rule, target), ...]
+        self.rules = []
+
+        # the smallest order of the rules in this sub tree,
+        # use it to skip the sub tree which can not win.
+        self.min_order = None
+
+
+class RuleDispatcher(object):
+    """Match the url to the rule without trying every rule one by one.
+
+    1. The static rules(Rule.dynamic=False) are stored in a dict, the key
+       is the url.
+    2. The dynamic rules are stored in a trie, each level of the trie is a
+       segment of the url. The static segment is looked up in a dict, the
+       dynamic segment is checked by its type(int, float, str).
+
+    So the cost of matching depends on the depth of the url, not the number
+    of the rules. Every rule has an order(the order of adding), if more than
+    one rule matches the url, the first added rule wins, the same as trying
+    the rules one by one.
+    """
+
+    def __init__(self):
+        # {'/example': (order, rule, target), ...}
+        self.static_rules = {}
+        self.root = _RuleNode()
+        self._order = 0
+
+    def add(self, rule, target):
+        """Add a rule.
+
+        :param rule: the instance of Rule
+        :param target: the object which will be returned when the rule matches.
+        """
+        order = self._order
+        self._order += 1
+
+        if not rule.dynamic:
+            url = '/' + '/'.join(item for item, _ in rule.match_order)
+            self.static_rules.setdefault(url, (order, rule, target))
+            return
+
+        node = self.root
+        self._update_min_order(node, order)
+        for item, _type in rule.match_order:
+            if _type is None:
+                node = node.static.setdefault(item, _RuleNode())
+            else:
+                node = node.dynamic.setdefault(_type.__name__, _RuleNode())
+            self._update_min_order(node, order)
+        node.rules.append((order, rule, target))
+
+    @staticmethod
+    def _update_min_order(node, order):
+        if node.min_order is None or order < node.min_order:
+            node.min_order = order
+
+    def match(self, url):
+        """Find the first added rule which matches the url.
+
+        :return: (rule, target, params) or None. The params is a dict,
+                 the key is the variable name and the value has been
+                 converted into its type.
+        """
+        best = self.static_rules.get(url)
+        if self.root.min_order is None or not url.startswith('/'):
+            return best and (best[1], best[2], {})
+
+        segments = url[1:].split('/')
+        # the 'str' type needs at least one lowercase letter from the
+        # segment to the end of the url.
+        has_lower = [False] * (len(segments) + 1)
+        for i in range(len(segments) - 1, -1, -1):
+            has_lower[i] = has_lower[i + 1] or \
+                _lower_re.search(segments[i]) is not None
+
+        limit = best[0] if best else None
+        found = self._search(self.root, segments, has_lower, 0, [], limit)
+        if found is not None:
+            order, rule, target, values = found
+            return rule, target, self._make_params(rule, values)
+        return best and (best[1], best[2], {})
+
+    def _search(self, node, segments, has_lower, depth, values, limit):
+        """Search the trie, return the matched rule whose order is the
+        smallest and less than limit.
+
+        :return: (order, rule, target, values) or None
+        """
+        if limit is not None and node.min_order >= limit:
+            return None
+
+        if depth == len(segments):
+            if not node.rules:
+                return None
+            order, rule, target = node.rules[0]
+            if limit is not None and order >= limit:
+                return None
+            return order, rule, target, list(values)
+
+        best = None
+        segment = segments[depth]
+        child = node.static.get(segment)
+        if child is not None:
+            best = self._search(child, segments, has_lower,
+                                depth + 1, values, limit)
+            if best is not None:
+                limit = best[0]
+
+        for type_name, child in node.dynamic.iteritems():
+            if not _segment_re_map[type_name].match(segment):
+                continue
+            if type_name == 'str' and not has_lower[depth]:
+                continue
+            values.append(segment)
+            found = self._search(child, segments, has_lower,
+                                 depth + 1, values, limit)
+            values.pop()
+            if found is not None:
+                best = found
+                limit = found[0]
+        return best
+
+    @staticmethod
+    def _make_params(rule, values):
+        """Convert the values of the dynamic segments into a dict."""
+        params = {}
+        variables = (item for item in rule.match_order if item[1] is not None)
+        for (variable, _type), value in zip(variables, values):
+            params[variable] = _type(value)
+        return params
+
+
 class Router(object):
 
     def __init__(self):
@@ -207,6 +367,14 @@ class Router(object):
         # [(Rule(), {'POST': <function post>, 'GET': <function get>}), ..]
         self.route_to_http_methods = []
 
+        # the compiled dispatchers of route_to_name and route_to_http_methods,
+        # use them to match the url instead of trying every rule.
+        self.name_dispatcher = RuleDispatcher()
+        self.resource_dispatcher = RuleDispatcher()
+
+        # rule_name -> function, the first added function wins.
+        self._name_to_func_map = {}
+
     def add(self, url, handler, **kwargs):
         """Add new url rule. Called by add_route in Puck.
 
@@ -214,28 +382,41 @@ class Router(object):
         :param handler: the relative function to the url rule. That is, if receiving a request to
                         THE url, it will be mapped to THE function to handle the request.
         :param methods: the methods that allows to this url.
+        The other kwargs are stored in Rule.options.
         """
-        rule_name = kwargs['rule_name']
-        methods = set(method.upper() for method in kwargs['methods'])
+        rule_name = kwargs.pop('rule_name')
+        methods = set(method.upper() for method in kwargs.pop('methods'))
         if 'GET' in methods and 'HEAD' not in methods:
             methods.add('HEAD')
-        rule = Rule(rule_str=url, rule_name=rule_name, methods=methods)
+        rule = Rule(rule_str=url, rule_name=rule_name, methods=methods,
+                    options=kwargs)
 
         self.route_to_name.append((rule, rule_name))
         self.name_to_func.append((rule_name, handler))
+        self.name_dispatcher.add(rule, rule_name)
+        self._name_to_func_map.setdefault(rule_name, handler)
 
-    def add_resource(self, url, resource):
+    def add_resource(self, url, resource, **options):
         """ONLY used when the user prepare to use api(Puck.use_api=True).
 
         :param url: the url rule will be added.
         :param resource: the instance of resource
+        :param options: stored in Rule.options.
         """
         http_methods_map = create_http_method_map(resource)
+        if 'HEAD' in http_methods_map:
+            # the same as the head option of Puck.route.
+            options.setdefault('head', http_methods_map['HEAD'])
+        elif 'GET' in http_methods_map:
+            # the body made by get() will be dropped, define head() to
+            # skip making it.
+            http_methods_map['HEAD'] = http_methods_map['GET']
         http_methods = http_methods_map.keys()
 
         rule = Rule(rule_str=url, rule_name=resource.__class__.__name__,
-                    methods=http_methods)
+                    methods=http_methods, options=options)
         self.route_to_http_methods.append((rule, http_methods_map))
+        self.resource_dispatcher.add(rule, http_methods_map)
 
     def url_for(self, rule_name, **kwargs):
         """According to the giving rule name(default value is function name)
@@ -250,21 +431,28 @@ class Router(object):
 
         :return: (function, a dict that the key is rule param)
         """
-        attribute = 'route_to_name'
+        _, func, params = self.match_rule(url, method)
+        return func, params
+
+    def match_rule(self, url, method):
+        """The same as match_url, but returns the matched rule too.
+
+        :return: (rule, function, a dict that the key is rule param)
+        """
+        dispatcher = self.name_dispatcher
         if self.route_to_http_methods:
-            attribute = 'route_to_http_methods'
+            dispatcher = self.resource_dispatcher
 
         # if when the user prepare to use api(Puck.use_api=True), part_2 is a dict: http_methods
         # else part_2 is a rule name
-        for rule, part_2 in getattr(self, attribute):
-            m = rule.rule_re.match(url)
-            if m is not None:
-                if method not in rule.methods:
-                    raise MethodNotAllowed()
-                func = self._search_func(part_2, method)
-                return func, self._convert_type(m.groupdict(), rule)
-        raise NotFound()
-        # return None, None, None
+        matched = dispatcher.match(url)
+        if matched is None:
+            raise NotFound()
+        rule, part_2, params = matched
+        if method not in rule.methods:
+            raise MethodNotAllowed()
+        func = self._search_func(part_2, method)
+        return rule, func, params
 
     def _convert_type(self, pair_dict, rule):
         """Convert the value into the original type. Example:
@@ -288,10 +476,7 @@ class Router(object):
 
     def _search_func(self, name, method):
         if not self.route_to_http_methods:
-            for _name, func in self.name_to_func:
-                if name == _name:
-                    return func
-            return None
+            return self._name_to_func_map.get(name)
         return name[method]
 
 
@@ -2,11 +2,388 @@
 """
 In this file, mainly handle choosing which WSGI Server to start
 the service.
+
+- WSGIrefServer: use wsgiref, handle one request at a time.
+- ThreadPoolServer: handle the requests in a bounded pool of threads.
+- PreforkServer: fork some worker processes which share the listening socket,
+  and restart the worker when it dies.
+- KeepAliveServer: like ThreadPoolServer, but keeps the HTTP/1.1 connections
+  open between the requests.
+- GeventServer: handle every request in a greenlet, the blocking I/O yields
+  to the other greenlets. gevent is required.
 """
+import os
+import sys
+import time
+import errno
+import signal
+import select
+import socket
+import threading
+import traceback
+from Queue import Queue
+from multiprocessing import cpu_count
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler, \
+    make_server
+
+from .data_structures import FileWrapper
+
+try:
+    from os import sendfile as _sendfile
+except ImportError:
+    try:
+        # python2 has no os.sendfile, the pysendfile package provides it.
+        from sendfile import sendfile as _sendfile
+    except ImportError:
+        _sendfile = None
+
+# socket.SO_REUSEPORT is not defined in python2, the value is 15 on linux.
+SO_REUSEPORT = getattr(
+    socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
+
+class ThreadPoolMixIn:
+    """Mix-in class to handle the requests in a bounded pool of threads.
+    The thread accepting the requests puts them into a queue, and blocks
+    when the queue is full.
+    """
+
+    # the number of the threads in the pool
+    threads = 10
+
+    # the max number of the accepted requests waiting for a thread
+    queue_size = 128
+
+    def start_pool(self):
+        """Start the threads. Call it in the process which serves the requests."""
+        self.requests = Queue(self.queue_size)
+        for _ in range(self.threads):
+            thread = threading.Thread(target=self.process_queue)
+            thread.daemon = True
+            thread.start()
+
+    def process_queue(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+
+class ReusePortMixIn:
+    """Mix-in class to set SO_REUSEPORT on the listening socket, so that
+    every process can bind its own socket to the same port."""
+
+    def server_bind(self):
+        if SO_REUSEPORT is None:
+            raise RuntimeError('SO_REUSEPORT is not supported on this platform.')
+        self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        WSGIServer.server_bind(self)
+
+
+class ThreadPoolWSGIServer(ThreadPoolMixIn, WSGIServer):
+    pass
+
+
+class KeepAliveWSGIServer(ThreadPoolWSGIServer):
+    """Serve persistent connections in a pool of threads. An idle connection
+    holds its thread until the timeout, so keep the timeout short."""
+
+    # seconds to wait for the next request on an idle connection
+    keep_alive_timeout = 5
+
+    # the max bytes of the unread request body, which will be read and
+    # dropped to reuse the connection. If it is larger, close the connection.
+    max_drain_size = 1024 * 64
+
+    def __init__(self, *args, **kwargs):
+        ThreadPoolWSGIServer.__init__(self, *args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            # the number of the accepted connections
+            'connections': 0,
+            # the number of the handled requests
+            'requests': 0,
+            # the number of the requests on a connection which has been used
+            'reused_requests': 0,
+        }
+
+    def incr_stats(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+
+class KeepAliveInput(object):
+    """The wsgi.input of a persistent connection. It never reads over the
+    body of the current request, so the next request on the connection is
+    left in the stream."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return ''
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return ''
+        line = self.stream.readline(size)
+        self.remaining -= len(line)
+        return line
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def drain(self, max_size):
+        """Read and drop the unread body.
+
+        :return: True if the body has been dropped, False if it is larger
+                 than max_size or the client has gone.
+        """
+        if self.remaining > max_size:
+            return False
+        while self.remaining > 0:
+            if not self.read(min(self.remaining, 1024 * 8)):
+                return False
+        return True
+
+
+class SendfileServerHandler(ServerHandler):
+    """Provide FileWrapper as wsgi.file_wrapper, and send it by sendfile, so
+    the data of the file is copied by the kernel instead of being read into
+    python. If sendfile is not available, or the file has no fileno(like a
+    StringIO), the file is sent block by block."""
+
+    wsgi_file_wrapper = FileWrapper
+
+    # the max size of one sendfile call
+    sendfile_block_size = 1024 * 1024
+
+    def finish_content(self):
+        if not self.headers_sent and self.environ['REQUEST_METHOD'] == 'HEAD':
+            # wsgiref sets Content-Length: 0 when no body is sent, but the body
+            # of a HEAD response is dropped, its length is unknown.
+            self.send_headers()
+        else:
+            ServerHandler.finish_content(self)
+
+    def sendfile(self):
+        if _sendfile is None:
+            return False
+        result = self.result
+        try:
+            in_fd = result.filelike.fileno()
+            out_fd = self.stdout.fileno()
+        except (AttributeError, IOError, ValueError):
+            return False
+
+        if not self.headers_sent:
+            self.send_headers()
+        if getattr(self, 'chunked', False):
+            return False
+        self._flush()
+
+        offset = result.offset
+        remaining = result.remaining
+        if remaining is None:
+            remaining = os.fstat(in_fd).st_size - offset
+        while remaining > 0:
+            try:
+                sent = _sendfile(out_fd, in_fd, offset,
+                                 min(remaining, self.sendfile_block_size))
+            except OSError as e:
+                if e.errno == errno.EAGAIN:     # the socket has a timeout
+                    select.select([], [out_fd], [])
+                    continue
+                raise
+            if not sent:
+                # the file is shorter than the Content-Length.
+                self.request_handler.close_connection = 1
+                break
+            offset += sent
+            remaining -= sent
+            self.bytes_sent += sent
+        return True
+
+
+class SendfileRequestHandler(WSGIRequestHandler):
+    """The same as WSGIRequestHandler, but uses SendfileServerHandler."""
+
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():    # An error code has been sent, just exit
+            return
+
+        handler = SendfileServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ()
+        )
+        handler.request_handler = self      # backpointer for logging
+        handler.run(self.server.get_app())
+
+
+class KeepAliveServerHandler(SendfileServerHandler):
+    """Send the response in HTTP/1.1. If the response has no Content-Length,
+    use the chunked transfer encoding, or close the connection when the
+    client does not support it."""
+
+    http_version = '1.1'
+    chunked = False
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        request_handler = self.request_handler
+        status_code = int(self.status[:3])
+        has_body = self.environ['REQUEST_METHOD'] != 'HEAD' and \
+            not (100 <= status_code < 200 or status_code in (204, 304))
+
+        if has_body and 'Content-Length' not in self.headers:
+            if request_handler.request_version == 'HTTP/1.1':
+                self.headers['Transfer-Encoding'] = 'chunked'
+                self.chunked = True
+            else:
+                request_handler.close_connection = 1
+
+        if request_handler.close_connection:
+            self.headers['Connection'] = 'close'
+        elif request_handler.request_version != 'HTTP/1.1':
+            self.headers['Connection'] = 'keep-alive'
+
+    def write(self, data):
+        if not self.status:
+            raise AssertionError("write() before start_response()")
+        elif not self.headers_sent:
+            self.bytes_sent = len(data)
+            self.send_headers()
+        else:
+            self.bytes_sent += len(data)
+
+        if self.chunked:
+            if not data:    # an empty chunk means the end of the body
+                return
+            data = '%x\r\n%s\r\n' % (len(data), data)
+        self._write(data)
+        self._flush()
+
+    def finish_content(self):
+        if self.chunked and self.headers_sent:
+            self._write('0\r\n\r\n')
+            self._flush()
+        else:
+            SendfileServerHandler.finish_content(self)
+
+    def handle_error(self):
+        # the response may be broken, do not reuse the connection.
+        self.request_handler.close_connection = 1
+        ServerHandler.handle_error(self)
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Handle the requests on a persistent HTTP/1.1 connection one by one,
+    the pipelined requests are read from the buffer of the connection."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.keep_alive_timeout
+        WSGIRequestHandler.setup(self)
+        self.server.incr_stats('connections')
+        self.handled = 0
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:  # the connection is idle for too long
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = 1
+            return
+        if not self.parse_request():    # An error code has been sent, just exit
+            self.close_connection = 1
+            return
+
+        self.server.incr_stats('requests')
+        if self.handled:
+            self.server.incr_stats('reused_requests')
+        self.handled += 1
+
+        environ = self.get_environ()
+        if 'Content-Length' not in self.headers and \
+                self.headers.get('Transfer-Encoding'):
+            # can not find the end of the body, so do not reuse the connection.
+            self.close_connection = 1
+        try:
+            content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            # can not find the end of the body either.
+            content_length = 0
+            self.close_connection = 1
+        stdin = KeepAliveInput(self.rfile, content_length)
+
+        handler = KeepAliveServerHandler(
+            stdin, self.wfile, self.get_stderr(), environ
+        )
+        handler.request_handler = self      # backpointer for logging
+        handler.run(self.server.get_app())
+
+        if not stdin.drain(self.server.max_drain_size):
+            self.close_connection = 1
+
+
+class ReusePortWSGIServer(ReusePortMixIn, WSGIServer):
+    pass
+
+
+class ReusePortThreadPoolWSGIServer(ReusePortMixIn, ThreadPoolWSGIServer):
+    pass
 
 
 class BaseServer(object):
     """Base Server class"""
+
+    # the options of Puck.run(workers, threads) supported by the server
+    run_options = ()
+
     def __init__(self, host, port, **options):
         self.host = host
         self.port = port
@@ -21,12 +398,280 @@ class BaseServer(object):
 class WSGIrefServer(BaseServer):
     """Use wsgiref to build a server"""
     def run(self, app):
-        from wsgiref.simple_server import make_server
+        self.options.setdefault('handler_class', SendfileRequestHandler)
+        server = make_server(
+            host=self.host,
+            port=self.port,
+            app=app,
+            **self.options
+        )
+        server.serve_forever()
+
+
+class ThreadPoolServer(BaseServer):
+    """Use wsgiref to build a server, which handles the requests in a bounded
+    pool of threads."""
+
+    run_options = ('threads',)
+
+    def __init__(self, host, port, threads=10, **options):
+        super(ThreadPoolServer, self).__init__(host, port, **options)
+        self.threads = threads
 
+    def run(self, app):
+        self.options.setdefault('server_class', ThreadPoolWSGIServer)
+        self.options.setdefault('handler_class', SendfileRequestHandler)
         server = make_server(
             host=self.host,
             port=self.port,
             app=app,
             **self.options
         )
+        server.threads = self.threads
+        server.start_pool()
+        server.serve_forever()
+
+
+class PreforkServer(BaseServer):
+    """Fork some worker processes to handle the requests, and restart the
+    worker when it dies. Stop all of the workers when receiving SIGINT or
+    SIGTERM.
+
+    By default, the listening socket is created before forking and shared
+    by the workers. If reuse_port=True, every worker binds its own socket
+    with SO_REUSEPORT, and the kernel balances the connections between them.
+    If threads > 1, every worker handles the requests in a pool of threads.
+
+    The error which stops a worker is printed to stderr. If a worker dies
+    within min_worker_lifetime seconds, the next one is spawned after a
+    growing delay, and the server gives up after max_worker_failures such
+    deaths in a row, like when the port is already in use.
+    """
+
+    run_options = ('workers', 'threads')
+
+    # a worker dying sooner than this(seconds) after starting is a failure
+    min_worker_lifetime = 1
+
+    # stop the server after this number of failures in a row
+    max_worker_failures = 5
+
+    # the max seconds to wait before spawning a worker after a failure
+    max_respawn_delay = 5
+
+    def __init__(self, host, port, workers=None, threads=1, reuse_port=False,
+                 **options):
+        super(PreforkServer, self).__init__(host, port, **options)
+        self.workers = workers or cpu_count()
+        self.threads = threads
+        self.reuse_port = reuse_port
+
+        # pid -> the start time of the worker processes
+        self.children = {}
+        self.running = False
+        # the number of the workers dying right after starting, in a row
+        self.failures = 0
+
+    def make_wsgi_server(self, app):
+        if self.reuse_port:
+            server_class = ReusePortWSGIServer
+            if self.threads > 1:
+                server_class = ReusePortThreadPoolWSGIServer
+        else:
+            server_class = WSGIServer
+            if self.threads > 1:
+                server_class = ThreadPoolWSGIServer
+        options = dict(self.options)
+        options.setdefault('server_class', server_class)
+        options.setdefault('handler_class', SendfileRequestHandler)
+        return make_server(self.host, self.port, app, **options)
+
+    def run(self, app):
+        server = None if self.reuse_port else self.make_wsgi_server(app)
+        self.running = True
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        try:
+            while self.running:
+                while self.running and len(self.children) < self.workers:
+                    if self.failures:
+                        time.sleep(min(0.1 * 2 ** self.failures,
+                                       self.max_respawn_delay))
+                        if not self.running:
+                            break
+                    self.spawn_worker(app, server)
+                try:
+                    pid, _ = os.wait()
+                except OSError as e:
+                    if e.errno in (errno.EINTR, errno.ECHILD):
+                        continue
+                    raise
+                # the worker has died, it will be restarted in the next loop.
+                self.worker_exited(pid)
+        finally:
+            self.kill_workers()
+            if server is not None:
+                server.server_close()
+
+    def worker_exited(self, pid):
+        started = self.children.pop(pid, None)
+        if started is None:
+            return
+        if time.time() - started >= self.min_worker_lifetime:
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.failures >= self.max_worker_failures:
+            raise RuntimeError(
+                '%d workers died right after starting, stop the server. '
+                'See the errors above.' % self.failures)
+
+    def spawn_worker(self, app, server):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return
+
+        # the worker process
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            if server is None:
+                server = self.make_wsgi_server(app)
+            if isinstance(server, ThreadPoolMixIn):
+                server.threads = self.threads
+                server.start_pool()
+            server.serve_forever()
+        except Exception:
+            sys.stderr.write('Worker %d stopped by an error:\n' % os.getpid())
+            traceback.print_exc()
+            sys.stderr.flush()
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def kill_workers(self):
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children.clear()
+
+
+class KeepAliveServer(ThreadPoolServer):
+    """Use a pool of threads to serve persistent HTTP/1.1 connections, with
+    pipelining and idle timeout. The responses without Content-Length are
+    sent in chunked transfer encoding.
+
+    :param keep_alive_timeout: seconds to wait for the next request on an idle
+                               connection.
+    """
+
+    def __init__(self, host, port, threads=10, keep_alive_timeout=5, **options):
+        super(KeepAliveServer, self).__init__(host, port, threads=threads, **options)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.server = None
+
+    def run(self, app):
+        self.options.setdefault('server_class', KeepAliveWSGIServer)
+        self.options.setdefault('handler_class', KeepAliveRequestHandler)
+        self.server = server = make_server(
+            host=self.host,
+            port=self.port,
+            app=app,
+            **self.options
+        )
+        server.keep_alive_timeout = self.keep_alive_timeout
+        server.threads = self.threads
+        server.start_pool()
         server.serve_forever()
+
+    def stats(self):
+        """Return the statistics of the connections, the reused_requests is
+        the number of the requests which reuse a connection."""
+        if self.server is None:
+            return {}
+        with self.server.stats_lock:
+            return dict(self.server.stats)
+
+
+def patch_gevent():
+    """Monkey-patch the standard library with gevent, so that the socket I/O
+    (like the redis connections of RedisSession) yields to the other greenlets.
+    It is safe to call it more than once. Call it as early as possible, better
+    before importing anything else, and before starting any threads.
+    """
+    from gevent import monkey
+    if not monkey.is_module_patched('socket'):
+        monkey.patch_all()
+
+
+class GeventServer(BaseServer):
+    """Use gevent.pywsgi to build a server, every request is handled in a
+    greenlet. The request_stack is keyed by (thread, greenlet), so the
+    request and session proxies are separated between the greenlets.
+
+    :param greenlets: the max number of the greenlets handling requests at
+                      the same time, None means no limit.
+    :param patch: whether monkey-patch the standard library before serving.
+    """
+
+    def __init__(self, host, port, greenlets=None, patch=True, **options):
+        super(GeventServer, self).__init__(host, port, **options)
+        self.greenlets = greenlets
+        self.patch = patch
+
+    def run(self, app):
+        if self.patch:
+            patch_gevent()
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer as GeventWSGIServer
+
+        spawn = Pool(self.greenlets) if self.greenlets else 'default'
+        server = GeventWSGIServer(
+            (self.host, self.port), app, spawn=spawn, **self.options
+        )
+        server.serve_forever()
+
+
+servers = {
+    'wsgiref': WSGIrefServer,
+    'threadpool': ThreadPoolServer,
+    'prefork': PreforkServer,
+    'keepalive': KeepAliveServer,
+    'gevent': GeventServer,
+}
+
+
+def get_server(server=None, workers=None, threads=None):
+    """Get the server class.
+
+    :param server: the name in servers, or a subclass of BaseServer. If it is
+                   None, choose the server by the workers and threads.
+    :param workers: the number of the worker processes.
+    :param threads: the number of the threads in one process.
+    """
+    if server is None:
+        if workers is not None:
+            server = 'prefork'
+        elif threads is not None:
+            server = 'threadpool'
+        else:
+            server = 'wsgiref'
+    if isinstance(server, basestring):
+        try:
+            return servers[server]
+        except KeyError:
+            raise ValueError('Unknown server: %s' % server)
+    return server
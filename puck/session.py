@@ -5,6 +5,9 @@ import time
 from datetime import datetime
 from hashlib import sha1
 import pickle
+from copy import deepcopy
+from collections import OrderedDict
+from threading import Lock
 from itsdangerous import Signer, BadSignature
 
 from .utils import get_utc_time_stamp
@@ -12,7 +15,16 @@ from .cookies import cookie_serialize, cookie_unserialize
 
 
 class SessionBase(object):
-    """The session class."""
+    """The session class.
+
+    The session tracks whether it has been changed in ``modified``, only the
+    modified session will be written into the storage. Setting or deleting a
+    key marks the session as modified, but changing a nested value can not
+    be seen, so set it by hand in that case:
+
+        session['cart'].append(item)
+        session.modified = True
+    """
 
     def __init__(self, secure_key, key, data=None):
         self.key = key
@@ -20,6 +32,13 @@ class SessionBase(object):
         self.secure_key = secure_key
         self.data.__setitem__(self.key, self._get_session_id())
 
+        # the flag whether the data has been changed after loading.
+        self.modified = False
+
+        # the number of the round trips to the storage for this session
+        # in the current request, including loading and saving.
+        self.round_trips = 0
+
     def _generate_session_id(self):
         signer = Signer(self.secure_key)
         tmp = sha1('%s%s' % (time.time(), uuid.uuid4())).hexdigest()
@@ -36,10 +55,26 @@ class SessionBase(object):
 
     def __setitem__(self, key, value):
         self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __contains__(self, item):
+        return item in self.data
 
     def get(self, item):
         return self.__getitem__(item)
 
+    def pop(self, key, default=None):
+        """Remove the key and return its value, mark the session as modified
+        only when the key exists."""
+        if key not in self.data:
+            return default
+        self.modified = True
+        return self.data.pop(key)
+
     def __repr__(self):
         return '<{} {}>'.format(
             self.__class__.__name__,
@@ -47,6 +82,59 @@ class SessionBase(object):
         )
 
 
+class LazySession(object):
+    """Stand in for the session of the current request. The session is
+    loaded from the storage the first time it is used, so the requests
+    which never use the session do not touch the storage at all.
+
+    :param loader: a callable without params, which returns the session.
+    """
+    __slots__ = ('_loader', '_session', 'is_loaded')
+
+    def __init__(self, loader):
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_session', None)
+        object.__setattr__(self, 'is_loaded', False)
+
+    @property
+    def round_trips(self):
+        """The round trips to the storage in this request, it does not load
+        the session."""
+        if not self.is_loaded or self._session is None:
+            return 0
+        return self._session.round_trips
+
+    def get_real_session(self):
+        """Load the session if it has not been loaded, and return it."""
+        if not self.is_loaded:
+            object.__setattr__(self, '_session', self._loader())
+            object.__setattr__(self, 'is_loaded', True)
+        return self._session
+
+    def __getattr__(self, item):
+        return getattr(self.get_real_session(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self.get_real_session(), key, value)
+
+    def __getitem__(self, item):
+        return self.get_real_session()[item]
+
+    def __setitem__(self, key, value):
+        self.get_real_session()[key] = value
+
+    def __delitem__(self, key):
+        del self.get_real_session()[key]
+
+    def __contains__(self, item):
+        return item in self.get_real_session()
+
+    def __repr__(self):
+        if not self.is_loaded:
+            return '<%s (not loaded)>' % self.__class__.__name__
+        return repr(self._session)
+
+
 class PickleMixin:
     """A mixin for classes which can use pickle to
     serialize or unserialize the data."""
@@ -81,6 +169,75 @@ class DictMixin:
                 raise ValueError('The data cannot be converted into a dict.')
 
 
+class SessionCache(object):
+    """A bounded in-process cache of the session data, keyed by session id.
+    Use it in front of the storage, so the hot sessions can be loaded without
+    a round trip to the storage.
+
+    The least recently used entry is evicted when there are more than
+    max_entries entries, and an entry expires after ttl seconds. The data is
+    copied when it is stored and loaded, so the requests never share one dict.
+
+    NOTE: the session written by another process is not seen until the entry
+    expires, so keep the ttl short.
+    """
+
+    def __init__(self, max_entries=1024, ttl=5):
+        """Init the cache.
+
+        :param max_entries: the max number of the sessions in the cache.
+        :param ttl: the seconds that a session can stay in the cache.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # session_id -> (expire_time, data)
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id):
+        """Return a copy of the cached data, or None if it is not cached."""
+        with self._lock:
+            item = self._data.pop(session_id, None)
+            if item is None or item[0] < time.time():
+                self.misses += 1
+                return None
+            # move it to the end, the most recently used one.
+            self._data[session_id] = item
+            self.hits += 1
+        return deepcopy(item[1])
+
+    def set(self, session_id, data):
+        """Store a copy of the data."""
+        item = (time.time() + self.ttl, deepcopy(data))
+        with self._lock:
+            self._data.pop(session_id, None)
+            self._data[session_id] = item
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return the statistics of the cache."""
+        return {
+            'entries': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
 def get_expire_seconds(session_expire):
     """Get the expire seconds.
 
@@ -129,6 +286,20 @@ class StoreSessionBase(object):
         pass
 
 
+# Load the session in one round trip: get the type of the key and the data
+# together. KEYS[1] is the session id.
+# return {type, data} or nil, data is a string or a flat list of a hash.
+LOAD_SESSION_SCRIPT = """
+local data_type = redis.call('TYPE', KEYS[1])['ok']
+if data_type == 'string' then
+    return {data_type, redis.call('GET', KEYS[1])}
+elseif data_type == 'hash' then
+    return {data_type, redis.call('HGETALL', KEYS[1])}
+end
+return nil
+"""
+
+
 class RedisSession(StoreSessionBase):
     """Use Redis to store sessions."""
     # use hash type to store the session
@@ -138,7 +309,8 @@ class RedisSession(StoreSessionBase):
     string_type = 'string'
 
     def __init__(self, redis_host, redis_port, secure_key, key,
-                 redis_db=0, redis_pw=None, use_pool=False, redis=None, max_conn=None):
+                 redis_db=0, redis_pw=None, use_pool=False, redis=None, max_conn=None,
+                 touch=False, cache=None):
         """Init redis session.
 
         :param redis_host: the host of redis
@@ -148,6 +320,11 @@ class RedisSession(StoreSessionBase):
         :param use_pool: whether use connection pool or not
         :param redis: the StrictRedis object
         :param max_conn: the number of the connections, only usable when use_pool=True
+        :param touch: if True, the session which is not modified but has an expire
+                      time will refresh its TTL with EXPIRE, instead of rewriting
+                      the whole data.
+        :param cache: an instance of SessionCache, if it is given, the sessions will
+                      be loaded from it before the redis.
         """
         # super(RedisSession, self).__init__(key=key, data=data, secure_key=secure_key)
         if redis is None:
@@ -164,6 +341,9 @@ class RedisSession(StoreSessionBase):
         self.key = key
         self.secure_key = secure_key
         self.redis = redis
+        self.touch = touch
+        self.cache = cache
+        self._load_script = redis.register_script(LOAD_SESSION_SCRIPT)
 
     def make_session(self, key, secure_key):
         """Make a new session"""
@@ -184,58 +364,71 @@ class RedisSession(StoreSessionBase):
         if not session_id:  # the session is not exists, create a new session
             return self.make_session(self.key, self.secure_key)
 
-        # the flag that whether delete the key from redis
-        del_flag = False
-
         if session_expire:  # has expire time
             if get_expire_seconds(session_expire) < 0:    # the session has expired, del from redis
-                del_flag = True
-
-        data_type = self.redis.type(session_id)
-        if data_type == self.string_type:
-            rawdata = self.redis.get(session_id)      # str
-        elif data_type == self.hash_type:
-            rawdata = self.redis.hgetall(session_id)  # dict
+                if self.cache is not None:
+                    self.cache.delete(session_id)
+                self.redis.delete(session_id)
+                session = self.make_session(self.key, self.secure_key)
+                session.round_trips += 1
+                return session
+
+        if self.cache is not None:
+            data = self.cache.get(session_id)
+            if data is not None:
+                return SessionBase(key=self.key, data=data, secure_key=self.secure_key)
+
+        rawdata = self._load_raw_data(session_id)
+
+        if not rawdata:     # the session is not exists, create a new session
+            session = self.make_session(self.key, self.secure_key)
         else:
-            rawdata = None
-
-        if rawdata is not None and del_flag:    # del from redis
-            self.redis.delete(session_id)
-            rawdata = None
-
-        # the session is not exists, create a new session
-        if not rawdata:
-            return self.make_session(self.key, self.secure_key)
-
-        data = self.unserialize(rawdata)
-        return SessionBase(key=self.key, data=data, secure_key=self.secure_key)
+            data = self.unserialize(rawdata)
+            session = SessionBase(key=self.key, data=data, secure_key=self.secure_key)
+            if self.cache is not None:
+                self.cache.set(session_id, session.data)
+        session.round_trips += 1
+        return session
+
+    def _load_raw_data(self, session_id):
+        """Get the type and the data of the session in one round trip.
+
+        :return: a string if the session is stored in string type, a dict if
+                 it is stored in hash type, None if it is not exist.
+        """
+        result = self._load_script(keys=[session_id], client=self.redis)
+        if not result:
+            return None
+        data_type, rawdata = result
+        if data_type == self.hash_type:
+            rawdata = dict(zip(rawdata[::2], rawdata[1::2]))
+        return rawdata
 
     def save_session(self, session, response, expire=None, path=None,
                      domain=None, secure=None, httponly=False):
-        """Save the session into the redis and update the session_id"""
+        """Save the session into the redis and update the session_id.
+
+        If the session is not modified, nothing will be written. But in touch
+        mode, if the expire time is given, the TTL of the session will be
+        refreshed and the cookie will be updated.
+        """
         session_id = session.get(self.key)
-        serialized_session = self.serialize(session.data)
 
+        expire_second = None
         if expire:
             expire = get_utc_time_stamp(expire)
             expire_second = get_expire_seconds(expire)
 
-        if not expire:
-            serialied_type = self.redis.set   # default: string
-            if isinstance(serialized_session, dict):
-                serialied_type = self.redis.hmset
-            # store the session into redis
-            serialied_type(session_id, serialized_session)
-
+        if session.modified:
+            self._write_session(session_id, session.data, expire_second)
+            if self.cache is not None:
+                self.cache.set(session_id, session.data)
+        elif self.touch and expire:
+            self.redis.expire(session_id, expire_second)
         else:
-            pipe = self.redis.pipeline()
-            serialied_type = pipe.set
-            if isinstance(serialized_session, dict):
-                serialied_type = pipe.hmset
-
-            serialied_type(session_id, serialized_session)
-            pipe.expire(session_id, expire_second)
-            pipe.execute()
+            return
+        session.modified = False
+        session.round_trips += 1
 
         session_data = cookie_serialize(self.secure_key, session_id, expire)
 
@@ -244,6 +437,22 @@ class RedisSession(StoreSessionBase):
             domain=domain, secure=secure, httponly=httponly
         )
 
+    def _write_session(self, session_id, data, expire_second=None):
+        """Serialize the data and store it into the redis in one round trip."""
+        serialized_session = self.serialize(data)
+
+        pipe = self.redis.pipeline()
+        if isinstance(serialized_session, dict):
+            # HMSET keeps the fields which are not given, so the deleted
+            # keys of the session should be removed first.
+            pipe.delete(session_id)
+            pipe.hmset(session_id, serialized_session)
+        else:
+            pipe.set(session_id, serialized_session)   # default: string
+        if expire_second is not None:
+            pipe.expire(session_id, expire_second)
+        pipe.execute()
+
 
 class RedisPickleSession(PickleMixin, RedisSession):
     """
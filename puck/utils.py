@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import time
 import datetime
+from email.utils import formatdate, parsedate_tz, mktime_tz
 
 # the days from 0001-01-01 to 1970-01-01
 _epoch_day = datetime.date(1970, 1, 1).toordinal()
@@ -51,12 +52,153 @@ def get_utc_time_stamp(expire):
     return seconds
 
 
+def http_date(timestamp):
+    """Outputs a string in the format " Thu, 01 Jan 1970 00:00:00 GMT "."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    """Parse the date of HTTP header into the timestamp, return None if the
+    value is invalid."""
+    if not value:
+        return None
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    try:
+        return mktime_tz(date)
+    except (OverflowError, ValueError):
+        return None
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def is_not_modified(environ, etag=None, last_modified=None):
+    """Check If-None-Match and If-Modified-Since of the request, If-Modified-Since
+    is ignored when If-None-Match is given.
+
+    :param environ: the WSGI environment
+    :param etag: the ETag of the response, like '"abc"'
+    :param last_modified: the timestamp of the Last-Modified of the response
+    :return: True if the client has the same response.
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if etag is None:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        etag = _strip_weak(etag)
+        for tag in if_none_match.split(','):
+            if _strip_weak(tag.strip()) == etag:
+                return True
+        return False
+
+    if last_modified is not None:
+        since = parse_http_date(environ.get('HTTP_IF_MODIFIED_SINCE'))
+        return since is not None and last_modified <= since
+    return False
+
+
+def parse_accept_encoding(value):
+    """Parse the Accept-Encoding header like ' gzip;q=1.0, deflate;q=0.5 '.
+
+    :return: a dict, {'gzip': 1.0, 'deflate': 0.5}
+    """
+    result = {}
+    for item in value.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        result[coding] = quality
+    return result
+
+
+def choose_encoding(accept_encoding, encodings=('gzip', 'deflate')):
+    """Choose the content coding by the Accept-Encoding of the request.
+
+    :param accept_encoding: the value of Accept-Encoding
+    :param encodings: the supported codings, in the order of preference.
+    :return: the coding or None.
+    """
+    if not accept_encoding:
+        return None
+    accepted = parse_accept_encoding(accept_encoding)
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def parse_range_header(value, size):
+    """Parse the Range header like ' bytes=0-99,200-,-50 '.
+
+    :param value: the value of the Range header
+    :param size: the size of the whole content
+    :return None if the header is invalid, which should be ignored, else a
+            list of (start, end), end is exclusive. The ranges over the size
+            are dropped, an empty list means that none is satisfiable.
+    """
+    if not value or not value.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in value[6:].split(','):
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        start, end = start.strip(), end.strip()
+        try:
+            if not start:
+                # the last N bytes
+                if not end:
+                    return None
+                length = int(end)
+                if length > 0 and size > 0:
+                    ranges.append((max(size - length, 0), size))
+                continue
+            start = int(start)
+            end = int(end) + 1 if end else None
+        except ValueError:
+            return None
+        if end is None:
+            end = size
+        elif end <= start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size)))
+    return ranges
+
+
+# the cache of generate_content_type, {(mime_type, charset): content_type}
+_content_types = {}
+
+
 def generate_content_type(mime_type, charset):
+    key = (mime_type, charset)
+    content_type = _content_types.get(key)
+    if content_type is not None:
+        return content_type
+
+    content_type = mime_type
     if mime_type.startswith('text/') or \
        mime_type == 'application/xml' or \
        (mime_type.startswith('application/') and mime_type.endswith('+xml')):
-        mime_type = mime_type + '; charset' + charset
-    return mime_type
+        content_type = mime_type + '; charset=' + charset
+    if len(_content_types) < 1024:
+        _content_types[key] = content_type
+    return content_type
 
 
 def _remove_end_characters(line):
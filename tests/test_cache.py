@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from puck import Puck, send_file
+from puck.cache import make_cache_key
+
+
+def call(app, path, method='GET', **environ):
+    environ.update(REQUEST_METHOD=method, PATH_INFO=path)
+    setup_testing_defaults(environ)
+    result = {}
+
+    def start_response(status, header_list, exc_info=None):
+        result['status'] = status
+        result['header'] = dict(header_list)
+
+    body = app(environ, start_response)
+    try:
+        result['body'] = ''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return result
+
+
+class InvalidateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Puck(secure_key='secure_key', compress=True,
+                        compress_min_size=0)
+        self.calls = 0
+
+        @self.app.route('/c', cache={'ttl': 60, 'vary': ('Accept-Language',)})
+        def c():
+            self.calls += 1
+            return 'content %d' % self.calls
+
+    def test_invalidate_all_codings_of_the_key(self):
+        call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='en')
+        call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='en', HTTP_ACCEPT_ENCODING='gzip')
+        call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(self.app.response_cache.stats()['entries'], 3)
+
+        self.app.invalidate_cache(key=make_cache_key('c', '/c', {}, ('en',)))
+        self.assertEqual(self.app.response_cache.stats()['entries'], 1)
+
+        result = call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='en')
+        self.assertEqual(result['body'], 'content 4')
+        result = call(self.app, '/c', HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(result['body'], 'content 3')
+
+    def test_invalidate_route(self):
+        call(self.app, '/c')
+        call(self.app, '/c', HTTP_ACCEPT_ENCODING='gzip')
+        self.app.invalidate_cache(route='c')
+        self.assertEqual(self.app.response_cache.stats()['entries'], 0)
+
+
+class FileResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'f.txt')
+        with open(self.path, 'wb') as f:
+            f.write('file content')
+
+        self.app = Puck(secure_key='secure_key')
+
+        @self.app.route('/cf', cache=60)
+        def cached_file():
+            return send_file(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_file_response_is_not_cached(self):
+        for _ in range(3):
+            result = call(self.app, '/cf')
+            self.assertEqual(result['status'], '200 OK')
+            self.assertEqual(result['header']['Content-Length'], '12')
+            self.assertEqual(result['body'], 'file content')
+        self.assertEqual(self.app.response_cache.stats()['entries'], 0)
+
+
+class FileResponseCoalesceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'f.txt')
+        with open(self.path, 'wb') as f:
+            f.write('file content')
+
+        self.app = Puck(secure_key='secure_key')
+
+        @self.app.route('/cf', coalesce=True)
+        def coalesced_file():
+            time.sleep(0.2)
+            return send_file(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_file_response_is_not_shared(self):
+        results = []
+
+        def request():
+            results.append(call(self.app, '/cf'))
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertEqual(result['status'], '200 OK')
+            self.assertEqual(result['header']['Content-Length'], '12')
+            self.assertEqual(result['body'], 'file content')
+        self.assertEqual(self.app.single_flight.stats()['shared'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from puck.data_structures import Header
+
+
+class HeaderTest(unittest.TestCase):
+
+    def assertIndexed(self, header):
+        """The index is the same as the one built from the list."""
+        index = {}
+        for _id, (key, _) in enumerate(header._list):
+            index.setdefault(header._index_key(key), []).append(_id)
+        self.assertEqual(header._index, index)
+
+    def test_case_insensitive(self):
+        header = Header([('Content-Type', 'text/html')])
+        self.assertEqual(header['content-type'], 'text/html')
+        self.assertEqual(header.get('content_type'), 'text/html')
+        self.assertTrue('CONTENT-TYPE' in header)
+
+        header['content-type'] = 'text/plain'
+        self.assertEqual(header.head_to_list(), [('Content-Type', 'text/plain')])
+
+    def test_exact_keys_of_form(self):
+        form = Header(base=False)
+        form.add('Name', 'a')
+        form.add('name', 'b')
+        self.assertEqual(form['Name'], 'a')
+        self.assertEqual(form['name'], 'b')
+        self.assertFalse('NAME' in form)
+
+    def test_duplicate_keys(self):
+        header = Header()
+        header.add('Set-Cookie', 'a=1')
+        header.add('Content-Type', 'text/html')
+        header.add('Set-Cookie', 'b=2')
+        self.assertEqual(header['Set-Cookie'], 'a=1')
+        self.assertEqual(header.get_all('set-cookie'), ['a=1', 'b=2'])
+
+        # setting the key changes the first one only.
+        header['Set-Cookie'] = 'c=3'
+        self.assertEqual(header.get_all('Set-Cookie'), ['c=3', 'b=2'])
+        self.assertIndexed(header)
+
+        # deleting the key deletes all of them.
+        del header['set-cookie']
+        self.assertEqual(header.head_to_list(), [('Content-Type', 'text/html')])
+        self.assertEqual(header.get_all('Set-Cookie'), [])
+        self.assertIndexed(header)
+
+    def test_delete_by_position(self):
+        header = Header([('A', '1'), ('B', '2'), ('A', '3')])
+        del header[0]
+        self.assertEqual(header['A'], '3')
+        self.assertEqual(header[0], ('B', '2'))
+        self.assertIndexed(header)
+
+        header[0] = ('C', '4')
+        self.assertFalse('B' in header)
+        self.assertEqual(header['c'], '4')
+        self.assertIndexed(header)
+
+    def test_random_operations(self):
+        """Compare with a plain list of pairs after random operations."""
+        rnd = random.Random(15)
+        keys = ['Content-Type', 'content-type', 'Set-Cookie', 'X-Id', 'x_id', 'ETag']
+
+        def index_key(key):
+            return key.replace('_', '-').lower()
+
+        for _ in range(200):
+            header = Header()
+            expected = []
+            for _ in range(30):
+                key = rnd.choice(keys)
+                value = str(rnd.randint(0, 9))
+                operation = rnd.random()
+                if operation < 0.4:
+                    header.add(key, value)
+                    expected.append((key, value))
+                elif operation < 0.7:
+                    header[key] = value
+                    for _id, item in enumerate(expected):
+                        if index_key(item[0]) == index_key(key):
+                            expected[_id] = (item[0], value)
+                            break
+                    else:
+                        expected.append((header._list[-1][0], value))
+                elif operation < 0.85 or not expected:
+                    del header[key]
+                    expected = [item for item in expected
+                                if index_key(item[0]) != index_key(key)]
+                else:
+                    _id = rnd.randrange(len(expected))
+                    del header[_id]
+                    del expected[_id]
+
+                self.assertEqual(header.head_to_list(), expected)
+                self.assertEqual(len(header), len(expected))
+                for key in keys:
+                    values = [v for k, v in expected if index_key(k) == index_key(key)]
+                    self.assertEqual(header.get_all(key), values)
+                    self.assertEqual(header.get(key), values[0] if values else None)
+                    self.assertEqual(key in header, bool(values))
+            self.assertIndexed(header)
+
+
+if __name__ == '__main__':
+    unittest.main()
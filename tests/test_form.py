@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from wsgiref.util import setup_testing_defaults
+
+from puck import Puck
+from puck.globals import request
+from puck.form import MultipartParser, parse_multipart
+from puck.exceptions import RequestEntityTooLarge
+
+
+def call(app, path, body, content_type, content_length=None):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': path,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)) if content_length is None else content_length,
+        'wsgi.input': StringIO(body),
+    }
+    setup_testing_defaults(environ)
+    result = {}
+
+    def start_response(status, header_list, exc_info=None):
+        result['status'] = status
+
+    result['body'] = ''.join(app(environ, start_response))
+    return result
+
+
+class ContentLengthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Puck(secure_key='secure_key', max_content_length=10)
+
+        @self.app.route('/data', methods=['POST'])
+        def data():
+            return str(len(request.data))
+
+        @self.app.route('/form', methods=['POST'])
+        def form():
+            return str(len(request.form))
+
+    def test_valid_length(self):
+        result = call(self.app, '/data', 'x' * 10, 'application/json')
+        self.assertEqual(result['status'], '200 OK')
+        self.assertEqual(result['body'], '10')
+
+    def test_too_large(self):
+        result = call(self.app, '/data', 'x' * 11, 'application/json')
+        self.assertEqual(result['status'][:3], '413')
+        self.assertEqual(self.app.rejection_stats(), {'max_content_length': 1})
+
+    def test_negative_length(self):
+        body = 'x' * 1024 * 100
+        result = call(self.app, '/data', body, 'application/json', '-1')
+        self.assertEqual(result['status'][:3], '400')
+
+        body = '&'.join('f%d=v' % i for i in range(5000))
+        result = call(self.app, '/form', body,
+                      'application/x-www-form-urlencoded', '-1')
+        self.assertEqual(result['status'][:3], '400')
+
+    def test_invalid_length(self):
+        result = call(self.app, '/data', 'x' * 100, 'application/json', 'abc')
+        self.assertEqual(result['status'][:3], '400')
+
+
+def make_multipart(parts, boundary='XyZ'):
+    """Make a multipart body from a list of (name, filename, data)."""
+    lines = []
+    for name, filename, data in parts:
+        disposition = 'Content-Disposition: form-data; name="%s"' % name
+        if filename is not None:
+            disposition += '; filename="%s"' % filename
+        lines.append('--%s\r\n%s\r\n\r\n%s\r\n' % (boundary, disposition, data))
+    lines.append('--%s--\r\n' % boundary)
+    return ''.join(lines)
+
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.files = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def make_app(self, **options):
+        app = Puck(secure_key='secure_key', **options)
+
+        @app.route('/upload', methods=['POST'])
+        def upload():
+            uploaded = request.file['f']
+            self.files['rolled'] = uploaded.stream._rolled
+            if uploaded.stream._rolled:
+                self.files['temp_name'] = uploaded.stream.name
+            destination = os.path.join(self.upload_dir, 'dest')
+            uploaded.create(destination)
+            with open(destination, 'rb') as f:
+                self.files['data'] = f.read()
+            return 'ok'
+        return app
+
+    def upload(self, app):
+        body = make_multipart([('f', 'a.txt', 'x' * 1000)])
+        result = call(app, '/upload', body, 'multipart/form-data; boundary=XyZ')
+        self.assertEqual(result['status'], '200 OK')
+        self.assertEqual(self.files['data'], 'x' * 1000)
+
+    def test_small_file_in_memory(self):
+        self.upload(self.make_app())
+        self.assertFalse(self.files['rolled'])
+
+    def test_zero_memory_size_spills_to_upload_dir(self):
+        self.upload(self.make_app(max_form_memory_size=0,
+                                  upload_dir=self.upload_dir))
+        self.assertTrue(self.files['rolled'])
+        temp_name = self.files['temp_name']
+        self.assertEqual(os.path.dirname(temp_name), self.upload_dir)
+        # the temporary file has been renamed to the destination.
+        self.assertFalse(os.path.exists(temp_name))
+
+
+def parse_parts(body, boundary='XyZ', chunk_size=8192, **options):
+    """Parse the body by MultipartParser, return a list of (name, data)."""
+    parts = []
+    parser = MultipartParser(StringIO(body), boundary, chunk_size, **options)
+    for event, value in parser:
+        if event == 'headers':
+            name = value[1].get('name')
+            data = []
+        elif event == 'data':
+            data.append(value)
+        else:
+            parts.append((name, ''.join(data)))
+    return parts
+
+
+class MultipartParserTest(unittest.TestCase):
+
+    parts = [
+        ('text', None, 'title'),
+        ('empty', None, ''),
+        # the data looks like the start of the boundary and line breaks.
+        ('tricky', None, '\r\n--Xy\r\n\r-\n--X\r\n--XyY\r'),
+        ('file', 'a.bin', 'binary\x00\r\ndata' * 50),
+    ]
+
+    def expected(self):
+        return [(name, data) for name, _, data in self.parts]
+
+    def test_every_chunk_size(self):
+        # the boundary and the CR/LF are split at every position of the chunks.
+        body = make_multipart(self.parts)
+        for chunk_size in range(1, 64):
+            self.assertEqual(parse_parts(body, chunk_size=chunk_size),
+                             self.expected(), 'chunk_size=%d' % chunk_size)
+
+    def test_preamble_and_epilogue(self):
+        body = 'the preamble\r\n--XyZ is not here\r\n' + \
+            make_multipart(self.parts) + 'the epilogue'
+        for chunk_size in (1, 7, 8192):
+            self.assertEqual(parse_parts(body, chunk_size=chunk_size),
+                             self.expected())
+
+    def test_lf_only(self):
+        body = make_multipart(self.parts[:2]).replace('\r\n', '\n')
+        for chunk_size in (1, 5, 8192):
+            self.assertEqual(parse_parts(body, chunk_size=chunk_size),
+                             [('text', 'title'), ('empty', '')])
+
+    def test_unexpected_end(self):
+        body = make_multipart(self.parts)[:-10]
+        self.assertRaises(ValueError, parse_parts, body)
+
+    def test_large_part_is_not_buffered(self):
+        data = 'x' * 1024 * 1024
+        body = make_multipart([('file', 'a.bin', data)])
+        parser = MultipartParser(StringIO(body), 'XyZ', 4096)
+        sizes = [len(value) for event, value in parser if event == 'data']
+        self.assertEqual(sum(sizes), len(data))
+        self.assertTrue(max(sizes) <= 4096)
+
+
+class MultipartLimitTest(unittest.TestCase):
+
+    def parse(self, body, **options):
+        return parse_multipart(StringIO(body), len(body), 'XyZ', **options)
+
+    def assertRejected(self, limit, body, **options):
+        try:
+            self.parse(body, **options)
+        except RequestEntityTooLarge as e:
+            self.assertEqual(e.limit, limit)
+        else:
+            self.fail('%s is not checked' % limit)
+
+    def test_max_header_size(self):
+        body = make_multipart([('a' * 200, None, 'value')])
+        self.assertRejected('max_form_header_size', body, max_header_size=100)
+        form, _ = self.parse(body, max_header_size=1000)
+        self.assertEqual(form['a' * 200], 'value')
+
+    def test_header_without_line_break(self):
+        body = '--XyZ\r\nContent-Disposition: form-data; name="' + 'a' * 20000
+        self.assertRejected('max_form_header_size', body)
+
+    def test_max_parts(self):
+        body = make_multipart([('f%d' % i, None, 'v') for i in range(5)])
+        self.assertRejected('max_form_parts', body, max_parts=4)
+        form, _ = self.parse(body, max_parts=5)
+        self.assertEqual(len(form), 5)
+
+    def test_max_field_size(self):
+        body = make_multipart([('field', None, 'x' * 101), ('file', 'a.txt', 'x' * 1000)])
+        self.assertRejected('max_form_field_size', body, max_field_size=100)
+        # the files are not limited by max_field_size.
+        body = make_multipart([('field', None, 'x' * 100), ('file', 'a.txt', 'x' * 1000)])
+        form, files = self.parse(body, max_field_size=100)
+        self.assertEqual(form['field'], 'x' * 100)
+        self.assertEqual(files['file'].stream.read(), 'x' * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
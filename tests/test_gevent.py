@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from puck import Puck
+from puck.globals import request, session
+from puck.session import SessionBase
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+
+class MemorySessionPuck(Puck):
+    """Keep the sessions in memory instead of the redis."""
+
+    def __init__(self, *args, **kwargs):
+        super(MemorySessionPuck, self).__init__(*args, **kwargs)
+        self.saved_sessions = {}
+
+    def get_session(self, request):
+        return SessionBase(self.secure_key, self.session_key)
+
+    def save_session(self, session, response, *args, **kwargs):
+        self.saved_sessions[session['user']] = session['path']
+
+
+@unittest.skipIf(gevent is None, 'gevent is not installed')
+class GreenletIsolationTest(unittest.TestCase):
+    """Every greenlet has its own request and session, even when thousands of
+    them switch to each other in the middle of the requests."""
+
+    greenlets = 2000
+
+    def setUp(self):
+        self.app = MemorySessionPuck(secure_key='secure_key')
+
+        @self.app.route('/user/<int:user>')
+        def user(user):
+            session['user'] = user
+            gevent.sleep(0)
+            session['path'] = request.path
+            for _ in range(3):
+                gevent.sleep(0)
+                if request.path != '/user/%d' % user or session['user'] != user:
+                    return 'mixed'
+            return str(user)
+
+    def call(self, user):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/user/%d' % user}
+        setup_testing_defaults(environ)
+        return ''.join(self.app(environ, lambda status, header_list: None))
+
+    def test_isolation(self):
+        jobs = [gevent.spawn(self.call, user) for user in range(self.greenlets)]
+        gevent.joinall(jobs, raise_error=True)
+        self.assertEqual([job.value for job in jobs],
+                         [str(user) for user in range(self.greenlets)])
+        self.assertEqual(len(self.app.saved_sessions), self.greenlets)
+        for user, path in self.app.saved_sessions.iteritems():
+            self.assertEqual(path, '/user/%d' % user)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from puck.response import FileResponse
+from puck.utils import parse_range_header, http_date
+
+
+class ParseRangeHeaderTest(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 100)])
+        self.assertEqual(parse_range_header('bytes=5-5', 1000), [(5, 6)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 1000)])
+        self.assertEqual(parse_range_header('bytes=-50', 1000), [(950, 1000)])
+        self.assertEqual(parse_range_header('bytes= 0-1 , 10-19,-5', 100),
+                         [(0, 2), (10, 20), (95, 100)])
+
+    def test_clipped_to_size(self):
+        self.assertEqual(parse_range_header('bytes=90-200', 100), [(90, 100)])
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 100)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range_header('bytes=100-', 100), [])
+        self.assertEqual(parse_range_header('bytes=200-300', 100), [])
+        self.assertEqual(parse_range_header('bytes=-0', 100), [])
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+
+    def test_invalid(self):
+        for value in (None, '', 'items=0-1', 'bytes=', 'bytes=1', 'bytes=-',
+                      'bytes=a-b', 'bytes=5-4', 'bytes=0-1,x'):
+            self.assertIsNone(parse_range_header(value, 100), value)
+
+
+class FileResponseTest(unittest.TestCase):
+
+    data = ''.join(chr(i % 256) for i in range(1000))
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'data.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get(self, method='GET', **environ):
+        environ['REQUEST_METHOD'] = method
+        setup_testing_defaults(environ)
+        result = {}
+
+        def start_response(status, header_list, exc_info=None):
+            result['status'] = status
+            result['header'] = dict(header_list)
+
+        response = FileResponse(self.path)
+        result['etag'] = response.etag
+        result['last_modified'] = response.last_modified
+        body = response(environ, start_response)
+        try:
+            result['body'] = ''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        self.assertTrue(response.file.closed)
+        return result
+
+    def test_whole_file(self):
+        result = self.get()
+        self.assertEqual(result['status'], '200 OK')
+        self.assertEqual(result['header']['Content-Length'], '1000')
+        self.assertEqual(result['header']['Accept-Ranges'], 'bytes')
+        self.assertEqual(result['header']['ETag'], result['etag'])
+        self.assertEqual(result['body'], self.data)
+
+    def test_single_range(self):
+        result = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(result['status'], '206 Partial Content')
+        self.assertEqual(result['header']['Content-Range'], 'bytes 100-199/1000')
+        self.assertEqual(result['header']['Content-Length'], '100')
+        self.assertEqual(result['body'], self.data[100:200])
+
+    def test_multiple_ranges(self):
+        result = self.get(HTTP_RANGE='bytes=0-9,-10')
+        self.assertEqual(result['status'], '206 Partial Content')
+        content_type = result['header']['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+        boundary = content_type.split('boundary=')[1]
+        body = result['body']
+        self.assertEqual(result['header']['Content-Length'], str(len(body)))
+        self.assertTrue(body.endswith('\r\n--%s--\r\n' % boundary))
+        self.assertTrue('Content-Range: bytes 0-9/1000\r\n\r\n' + self.data[:10] in body)
+        self.assertTrue('Content-Range: bytes 990-999/1000\r\n\r\n' + self.data[-10:] in body)
+
+    def test_unsatisfiable_range(self):
+        result = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(result['status'], '416 Requested Range Not Satisfiable')
+        self.assertEqual(result['header']['Content-Range'], 'bytes */1000')
+        self.assertEqual(result['body'], '')
+
+    def test_invalid_range_sends_whole_file(self):
+        result = self.get(HTTP_RANGE='bytes=9-1')
+        self.assertEqual(result['status'], '200 OK')
+        self.assertEqual(result['body'], self.data)
+
+    def test_if_range(self):
+        etag = self.get()['etag']
+        result = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(result['status'], '206 Partial Content')
+        result = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"changed"')
+        self.assertEqual(result['status'], '200 OK')
+        self.assertEqual(result['body'], self.data)
+
+        last_modified = http_date(self.get()['last_modified'])
+        result = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=last_modified)
+        self.assertEqual(result['status'], '206 Partial Content')
+        result = self.get(HTTP_RANGE='bytes=0-9',
+                          HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT')
+        self.assertEqual(result['status'], '200 OK')
+
+    def test_head(self):
+        result = self.get('HEAD', HTTP_RANGE='bytes=0-9')
+        self.assertEqual(result['status'], '206 Partial Content')
+        self.assertEqual(result['header']['Content-Length'], '10')
+        self.assertEqual(result['body'], '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import itertools
+import unittest
+
+from puck.routing import Router
+from puck.exceptions import NotFound, MethodNotAllowed
+
+
+RULES = [
+    ('/', ('GET',)),
+    ('/about', ('GET',)),
+    ('/user/<int:id>', ('GET',)),
+    ('/user/me', ('GET', 'POST')),
+    ('/user/<name>', ('POST',)),
+    ('/user/<int:id>/posts', ('GET',)),
+    ('/user/<str:name>/posts', ('GET',)),
+    ('/user/<name>/<int:page>', ('GET',)),
+    ('/price/<float:value>', ('GET',)),
+    ('/price/<int:value>', ('GET',)),
+    ('/price/<str:value>', ('GET',)),
+    ('/files/<str:a>/<str:b>/<str:c>', ('GET',)),
+    ('/files/static/1/2', ('GET',)),
+    ('/a/<int:x>/b', ('GET',)),
+    ('/a/<str:x>/b', ('PUT',)),
+    ('/a/1/b', ('DELETE',)),
+]
+
+SEGMENTS = ['', 'user', 'me', 'posts', 'price', 'files', 'static', 'a', 'b',
+            '1', '42', '1.5', '3.', 'bob', 'Bob', 'BOB', 'x-y', 'a_b', '--',
+            '007', 'about']
+
+
+def linear_match(router, url, method):
+    """The old Router.match_url: run the regex of every rule in order."""
+    for rule, rule_name in router.route_to_name:
+        m = rule.rule_re.match(url)
+        if m is not None:
+            if method not in rule.methods:
+                raise MethodNotAllowed()
+            return rule_name, router._convert_type(m.groupdict(), rule)
+    raise NotFound()
+
+
+def result_of(match, *args):
+    try:
+        return match(*args)
+    except (NotFound, MethodNotAllowed) as e:
+        return e.__class__.__name__
+
+
+class DispatcherParityTest(unittest.TestCase):
+    """The dispatcher matches the same rule and params as the linear scan of
+    the regular expressions, in the order of the rules."""
+
+    def setUp(self):
+        self.router = Router()
+        for i, (url, methods) in enumerate(RULES):
+            self.router.add(url, lambda: None, rule_name='rule%d' % i,
+                            methods=methods)
+
+    def match(self, url, method):
+        rule, _, params = self.router.match_rule(url, method)
+        return rule.rule_name, params
+
+    def urls(self):
+        yield '/'
+        for depth in range(1, 5):
+            for segments in itertools.product(SEGMENTS, repeat=depth):
+                if depth == 4 and segments[0] not in ('files', 'user'):
+                    continue
+                yield '/' + '/'.join(segments)
+
+    def test_parity(self):
+        count = 0
+        for url in self.urls():
+            for method in ('GET', 'POST'):
+                self.assertEqual(
+                    result_of(self.match, url, method),
+                    result_of(linear_match, self.router, url, method),
+                    '%s %s' % (method, url))
+                count += 1
+        self.assertTrue(count > 10000)
+
+    def test_first_match_wins(self):
+        self.assertEqual(self.match('/user/me', 'GET'), ('rule3', {}))
+        self.assertEqual(self.match('/user/42', 'GET'), ('rule2', {'id': 42}))
+        self.assertEqual(self.match('/price/1.5', 'GET'), ('rule8', {'value': 1.5}))
+        self.assertEqual(self.match('/files/static/1/2', 'GET'),
+                         ('rule12', {}))
+        self.assertRaises(MethodNotAllowed, self.match, '/a/1/b', 'DELETE')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import time
+import socket
+import httplib
+import threading
+import unittest
+
+from puck import Puck
+from puck.response import Response
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def make_app():
+    app = Puck(secure_key='secure_key')
+
+    @app.route('/g')
+    def streamed():
+        return (chunk for chunk in ('a', 'b', 'c'))
+
+    def report_head():
+        return Response(header=[('Content-Type', 'text/plain')])
+
+    @app.route('/report', head=report_head)
+    def report():
+        return 'report'
+
+    return app
+
+
+class HeadResponseTest(unittest.TestCase):
+    """The built-in servers should not make up a Content-Length for the HEAD
+    responses, which have no body."""
+
+    def start(self, server):
+        app = make_app()
+        port = free_port()
+        thread = threading.Thread(target=app.run, kwargs=dict(
+            port=port, server=server))
+        thread.daemon = True
+        thread.start()
+        for _ in range(50):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.02)
+        return port
+
+    def request(self, port, method, path):
+        connection = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.request(method, path)
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+        return response, body
+
+    def check_server(self, server):
+        port = self.start(server)
+        for path in ('/g', '/report'):
+            response, body = self.request(port, 'HEAD', path)
+            self.assertEqual(response.status, 200)
+            self.assertIsNone(response.getheader('Content-Length'))
+            self.assertEqual(body, '')
+
+        response, body = self.request(port, 'GET', '/report')
+        self.assertEqual(response.getheader('Content-Length'), '6')
+        self.assertEqual(body, 'report')
+        return port
+
+    def test_wsgiref(self):
+        self.check_server('wsgiref')
+
+    def test_threadpool(self):
+        self.check_server('threadpool')
+
+    def test_keepalive(self):
+        port = self.check_server('keepalive')
+        response, body = self.request(port, 'GET', '/g')
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(body, 'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from puck.globals import request_stack, session
+from puck.session import SessionBase, LazySession
+
+
+class _Context(object):
+
+    def __init__(self, session):
+        self.session = session
+
+
+class SessionProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = LazySession(
+            lambda: SessionBase('secure_key', 'session_id', {'user': 'eric'}))
+        request_stack.push(_Context(self.session))
+
+    def tearDown(self):
+        request_stack.pop()
+
+    def test_delete_through_proxy(self):
+        self.assertFalse(self.session.modified)
+        del session['user']
+        self.assertTrue(self.session.modified)
+        self.assertIsNone(session['user'])
+
+    def test_contains_through_proxy(self):
+        self.assertTrue('user' in session)
+        self.assertFalse('missing' in session)
+        self.assertFalse(self.session.modified)
+
+
+if __name__ == '__main__':
+    unittest.main()